@@ -0,0 +1,226 @@
+import random
+import time
+from collections import OrderedDict
+
+from engine import Attack, BattleState, Swap, computer_action
+
+# difficulties above 5 look ahead instead of rolling dice
+SEARCH_DEPTHS = {6: 4, 7: 64}
+MAX_DIFFICULTY = max(SEARCH_DEPTHS)
+WIN = 1000.0
+# nodes a search may visit per move when it runs without a clock, about
+# what the default 50ms deadline allows; batch runs use this so their
+# results don't depend on how busy the machine is
+BATCH_NODES = 5_000
+
+class _OutOfBudget(Exception):
+    pass
+
+class SearchAI:
+    '''
+    Alpha-beta search over the battle rules, deepening one ply at a time
+    until the per-turn deadline (in seconds) runs out, or with max_nodes
+    until it has visited that many positions, which makes its choices depend
+    only on the battle; a None deadline turns the clock off. Positions are
+    remembered in a transposition table keyed on bucketed HP, active slots
+    and whose move it is, evicting the least recently used entries once it
+    holds `table_size` of them.
+    '''
+
+    def __init__(self, deadline=0.05, max_depth=64, table_size=100_000, hp_bucket=10, max_nodes=None):
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.table_size = table_size
+        self.hp_bucket = hp_bucket
+        self.table: OrderedDict = OrderedDict()
+        self._teams = None
+        # positions this battle already had to move from; see choose()
+        self._seen = set()
+        self.depth_reached = 0
+
+    def __call__(self, state: BattleState):
+        return self.choose(state)
+
+    def choose(self, state: BattleState):
+        side = state.sides[state.to_move]
+        root = (
+            tuple(state.sides[0].hp), tuple(state.sides[1].hp),
+            state.sides[0].active_index, state.sides[1].active_index,
+            state.to_move, state.replacing,
+        )
+        # leave a little of the deadline for unwinding the search
+        self._stop = time.perf_counter() + 0.9 * self.deadline if self.deadline is not None else float('inf')
+        self._load(state)
+        self._nodes = 0
+        # two searchers can swap back and forth forever, each answering the
+        # other; back at a position it already moved from, attack instead
+        repeated = root in self._seen and not state.replacing
+        self._seen.add(root)
+        # attacks come first, so this is one whenever there is one
+        best = self._moves(root)[0][0]
+        for depth in range(1, self.max_depth + 1):
+            try:
+                best, value = self._root(root, depth, repeated)
+            except _OutOfBudget:
+                break
+            self.depth_reached = depth
+            if abs(value) >= WIN:
+                # a forced win or loss, looking further won't change it
+                break
+        kind, value = best
+        if kind == 'swap':
+            return Swap(value)
+        return Attack(self._names[state.to_move][side.active_index][value])
+
+    def _load(self, state):
+        # damage of every attack of every slot against every opposing slot, deduplicated
+        # by damage so equivalent attacks aren't searched twice
+        self._damage = ([], [])
+        self._names = ([], [])
+        self._max_hp = tuple(sum(p.health_points for p in side.pokemon) or 1 for side in state.sides)
+        for s, side in enumerate(state.sides):
+            opponent = state.sides[1 - s].pokemon
+            for attacker in side.pokemon:
+                names = list(dict.fromkeys(attacker.attacks))
+                self._names[s].append(names)
+                self._damage[s].append([
+                    [state.attack_damage(attacker, defender, name) for name in names]
+                    for defender in opponent
+                ])
+        # entries only make sense for the teams they were stored with
+        teams = tuple(tuple(p.name for p in side.pokemon) for side in state.sides)
+        if self._teams != teams:
+            self.table.clear()
+            self._seen.clear()
+            self._teams = teams
+
+    def _moves(self, node):
+        ''' (move, child, terminal value) for every move from node, best guesses first '''
+        hp0, hp1, active0, active1, mover, replacing = node
+        hps = (hp0, hp1)
+        actives = (active0, active1)
+        own, other = hps[mover], hps[1 - mover]
+        active, target = actives[mover], actives[1 - mover]
+        moves = []
+
+        def child(own_hp, other_hp, own_active, to_move, replacing):
+            if mover == 0:
+                return (own_hp, other_hp, own_active, target, to_move, replacing)
+            return (other_hp, own_hp, target, own_active, to_move, replacing)
+
+        if replacing:
+            for i, hp in enumerate(own):
+                if hp:
+                    moves.append((('swap', i), child(own, other, i, mover, False), None))
+            return moves
+
+        damages = self._damage[mover][active][target]
+        attacks = sorted(range(len(damages)), key=lambda i: -damages[i])
+        seen = set()
+        for i in attacks:
+            if damages[i] in seen:
+                continue
+            seen.add(damages[i])
+            left = max(0, other[target] - damages[i])
+            other_hp = other[:target] + (left,) + other[target + 1:]
+            if not any(other_hp):
+                moves.append((('attack', i), None, WIN))
+            else:
+                moves.append((('attack', i), child(own, other_hp, active, 1 - mover, not left), None))
+        for i, hp in enumerate(own):
+            if hp and i != active:
+                moves.append((('swap', i), child(own, other, i, 1 - mover, False), None))
+        return moves
+
+    def _key(self, node):
+        hp0, hp1, active0, active1, mover, replacing = node
+        bucket = self.hp_bucket
+        return (
+            tuple(-(-hp // bucket) for hp in hp0), tuple(-(-hp // bucket) for hp in hp1),
+            active0, active1, mover, replacing,
+        )
+
+    def _evaluate(self, node):
+        hp0, hp1, _, _, mover, _ = node
+        score = sum(hp0) / self._max_hp[0] - sum(hp1) / self._max_hp[1]
+        return score if mover == 0 else -score
+
+    def _root(self, node, depth, attacks_only=False):
+        best, best_value = None, -float('inf')
+        alpha = -float('inf')
+        moves = self._ordered(node)
+        if attacks_only and any(move[0] == 'attack' for move, _, _ in moves):
+            moves = [item for item in moves if item[0][0] == 'attack']
+        for move, child, terminal in moves:
+            value = terminal + depth if terminal is not None else self._value(node, child, depth - 1, alpha, float('inf'))
+            if value > best_value:
+                best, best_value = move, value
+            alpha = max(alpha, value)
+        self._store(self._key(node), depth, best_value, 0, best)
+        return best, best_value
+
+    def _value(self, node, child, depth, alpha, beta):
+        # negamax: a child where the same side moves again (a replacement) keeps its sign
+        if child[4] == node[4]:
+            return self._negamax(child, depth, alpha, beta)
+        return -self._negamax(child, depth, -beta, -alpha)
+
+    def _ordered(self, node):
+        moves = self._moves(node)
+        entry = self.table.get(self._key(node))
+        if entry is not None:
+            for i, move in enumerate(moves):
+                if move[0] == entry[3]:
+                    moves.insert(0, moves.pop(i))
+                    break
+        return moves
+
+    def _negamax(self, node, depth, alpha, beta):
+        self._nodes += 1
+        if self.max_nodes is not None and self._nodes > self.max_nodes:
+            raise _OutOfBudget
+        if not self._nodes & 31 and time.perf_counter() > self._stop:
+            raise _OutOfBudget
+        if depth <= 0:
+            return self._evaluate(node)
+
+        key = self._key(node)
+        entry = self.table.get(key)
+        if entry is not None:
+            self.table.move_to_end(key)
+            entry_depth, value, bound, _ = entry
+            if entry_depth >= depth and (
+                bound == 0 or (bound < 0 and value <= alpha) or (bound > 0 and value >= beta)
+            ):
+                return value
+
+        original_alpha = alpha
+        best, best_value = None, -float('inf')
+        for move, child, terminal in self._ordered(node):
+            value = terminal + depth if terminal is not None else self._value(node, child, depth - 1, alpha, beta)
+            if value > best_value:
+                best, best_value = move, value
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        # bound: -1 upper bound (failed low), 1 lower bound (cut off), 0 exact
+        bound = -1 if best_value <= original_alpha else 1 if best_value >= beta else 0
+        self._store(key, depth, best_value, bound, best)
+        return best_value
+
+    def _store(self, key, depth, value, bound, move):
+        self.table[key] = (depth, value, bound, move)
+        self.table.move_to_end(key)
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+
+def computer_policy(difficulty=2, rng=random, deadline=0.05, max_nodes=None):
+    '''
+    a callable(state) -> action for the given difficulty (1-7); the searching
+    ones stop at the deadline or after max_nodes, whichever comes first
+    '''
+    if difficulty in SEARCH_DEPTHS:
+        return SearchAI(deadline, SEARCH_DEPTHS[difficulty], max_nodes=max_nodes)
+    return lambda state: computer_action(state, difficulty, rng)
@@ -0,0 +1,141 @@
+import argparse
+
+import numpy as np
+
+from pokemon import RESISTANCE_REDUCTION, WEAKNESS_MULTIPLIER, PokemonManager, SpeciesTable
+from simulate import MAX_TURNS
+
+class BatchBattle:
+    '''
+    Thousands of computer-vs-computer battles stepped together as NumPy arrays.
+    Follows the same rules as engine.BattleState with engine.computer_action
+    on both sides: damage after weakness and resistance, attack with
+    probability 0.5 + 0.1 * difficulty (or when there is nothing to swap
+    to), otherwise swap to a random alive pokemon, and send out the first
+    alive pokemon after a faint.
+    '''
+
+    def __init__(self, roster, teams, difficulty=2, seed=0):
+        # roster: a list of Pokemon or a SpeciesTable
+        # teams: int array (battles, 2, pick_limit) of indices into roster
+        # difficulty: a scalar, one per side, or an array of shape (battles, 2)
+        self.rng = np.random.default_rng(seed)
+        table = roster if isinstance(roster, SpeciesTable) else SpeciesTable(roster)
+        start = np.frombuffer(table.attack_start, dtype=np.uint32).astype(np.int64)
+        self.n_attacks = np.diff(start)
+        # ragged attack lists padded into a (species, max attacks) table
+        damage = np.frombuffer(table.attack_damage, dtype=np.uint32)
+        slot = np.arange(len(damage)) - np.repeat(start[:-1], self.n_attacks)
+        self.damage = np.zeros((len(table), self.n_attacks.max()), dtype=np.int32)
+        self.damage[np.repeat(np.arange(len(table)), self.n_attacks), slot] = damage
+        max_hp = np.frombuffer(table.health_points, dtype=np.uint32).astype(np.int32)
+        self.type_ids = np.frombuffer(table.type_ids, dtype=np.uint16).astype(np.int64)
+        self.weakness_ids = np.frombuffer(table.weakness_ids, dtype=np.uint16)
+        self.resistance_ids = np.frombuffer(table.resistance_ids, dtype=np.uint16)
+        if "" in table.types:
+            # attacks of untyped pokemon are never super effective
+            self.type_ids[self.type_ids == table.types.index("")] = -1
+
+        self.teams = np.asarray(teams, dtype=np.int64)
+        battles = len(self.teams)
+        self.hp = max_hp[self.teams]
+        self.active = np.zeros((battles, 2), dtype=np.int64)
+        self.to_move = np.zeros(battles, dtype=np.int64)
+        self.winner = np.full(battles, -1, dtype=np.int64)
+        self.turns = np.zeros(battles, dtype=np.int64)
+        difficulty = np.asarray(difficulty, dtype=np.float64)
+        self.attack_chance = np.broadcast_to(0.5 + 0.1 * difficulty, (battles, 2))
+
+    @property
+    def over(self) -> bool:
+        return not (self.winner < 0).any()
+
+    def step(self):
+        live = np.flatnonzero(self.winner < 0)
+        if not len(live):
+            return
+        mover = self.to_move[live]
+        other = 1 - mover
+        hp = self.hp[live, mover]
+        active = self.active[live, mover]
+        slots = np.arange(hp.shape[1])
+        can_swap = (hp > 0) & (slots != active[:, None])
+
+        attacking = (self.rng.random(len(live)) < self.attack_chance[live, mover]) | ~can_swap.any(axis=1)
+
+        # attacks: a random move of the active pokemon, no lower than 0 hp
+        b, m, o = live[attacking], mover[attacking], other[attacking]
+        species = self.teams[b, m, self.active[b, m]]
+        move = (self.rng.random(len(b)) * self.n_attacks[species]).astype(np.int64)
+        target = self.active[b, o]
+        defender = self.teams[b, o, target]
+        attack_type = self.type_ids[species]
+        damage = self.damage[species, move]
+        damage = np.where(self.weakness_ids[defender] == attack_type, damage * WEAKNESS_MULTIPLIER, damage)
+        damage = np.where(self.resistance_ids[defender] == attack_type, np.maximum(0, damage - RESISTANCE_REDUCTION), damage)
+        self.hp[b, o, target] = np.maximum(0, self.hp[b, o, target] - damage)
+
+        fainted = self.hp[b, o, target] == 0
+        b, m, o = b[fainted], m[fainted], o[fainted]
+        alive = self.hp[b, o] > 0
+        has_alive = alive.any(axis=1)
+        self.winner[b[~has_alive]] = m[~has_alive]
+        self.active[b[has_alive], o[has_alive]] = alive[has_alive].argmax(axis=1)
+
+        # swaps: a random alive pokemon other than the active one
+        swapping = ~attacking
+        keys = self.rng.random(can_swap[swapping].shape)
+        keys[~can_swap[swapping]] = -1.0
+        self.active[live[swapping], mover[swapping]] = keys.argmax(axis=1)
+
+        self.turns[live] += 1
+        self.to_move[live] = other
+
+    def run(self, max_turns=MAX_TURNS) -> np.ndarray:
+        '''
+        steps until every battle is over and returns the winning side of each,
+        or -1 for those still going after max_turns, which are draws
+        '''
+        for _ in range(max_turns):
+            if self.over:
+                break
+            self.step()
+        return self.winner
+
+def random_teams(roster_size, pick_limit, battles, rng) -> np.ndarray:
+    ''' alternating random drafts, like simulate.draft(), for a whole batch at once '''
+    if 2 * pick_limit > roster_size:
+        raise ValueError(f"A roster of {roster_size} pokemon can't field two teams of {pick_limit}.")
+    picks = rng.random((battles, roster_size)).argsort(axis=1)[:, :2 * pick_limit]
+    return np.stack([picks[:, 0::2], picks[:, 1::2]], axis=1)
+
+def sweep(roster, pick_limit=2, difficulties=(1, 2, 3, 4, 5), battles=10000, seed=0) -> dict:
+    '''
+    For every pair of difficulties, the first side's score over random
+    drafts: its wins plus half the draws, as simulate counts them.
+    '''
+    if not isinstance(roster, SpeciesTable):
+        roster = SpeciesTable(roster)
+    rng = np.random.default_rng(seed)
+    teams = random_teams(len(roster), pick_limit, battles, rng)
+    results = {}
+    for a in difficulties:
+        for b in difficulties:
+            winner = BatchBattle(roster, teams, difficulty=(a, b), seed=rng.integers(2**63)).run()
+            results[(a, b)] = float(np.where(winner < 0, 0.5, winner == 0).mean())
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep computer difficulties against each other in batched battles.")
+    parser.add_argument('--file', default="pokemon.json")
+    parser.add_argument('-n', '--battles', type=int, default=10000)
+    parser.add_argument('--pick-limit', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    roster = PokemonManager(args.file).species_table()
+    for (a, b), rate in sweep(roster, args.pick_limit, battles=args.battles, seed=args.seed).items():
+        print(f"difficulty {a} vs {b}: first side scores {rate:6.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from ai import MAX_DIFFICULTY, computer_policy
+from engine import BattleState, Player, computer_action
+from pokemon import DamageMatrix, Pokemon, PokemonManager
+from simulate import simulate
+from snapshot import snapshot_path
+
+# Every benchmark returns {name: {"value", "unit", "better"}}, with "better"
+# either "higher" or "lower", so results can be compared against a baseline
+# without knowing what each one measures.
+
+TYPES = ["fire", "water", "grass", "electric", "ice", "gost", "fiting", "metel", "psychic", ""]
+GROUPS = ["turns", "io", "ai", "simulate"]
+
+def result(value, unit, better) -> dict:
+    return {"value": value, "unit": unit, "better": better}
+
+def synthetic_roster(size, seed=0) -> list[Pokemon]:
+    ''' size made-up pokemon with the same shape of stats as the real roster '''
+    rng = random.Random(seed)
+    roster = []
+    for i in range(size):
+        type_ = rng.choice(TYPES[:-1])
+        roster.append(Pokemon(
+            f"synthetic-{i}",
+            type_,
+            rng.randrange(60, 260, 10),
+            rng.randrange(3),
+            {f"move-{i}-{a}": rng.randrange(10, 200, 10) for a in range(rng.randint(1, 3))},
+            rng.choice([t for t in TYPES if t != type_]),
+            rng.choice(TYPES),
+        ))
+    return roster
+
+def bench_turns(seconds=2.0, pick_limit=3, seed=0) -> dict:
+    ''' battle loop turns per second, dice-rolling computers on both sides '''
+    rng = random.Random(seed)
+    roster = synthetic_roster(100, seed)
+    damage = DamageMatrix(roster)
+    policy = lambda state: computer_action(state, 2, rng)
+    best = 0.0
+    # the best of three windows, see _timed
+    for _ in range(3):
+        turns = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds / 3:
+            picks = rng.sample(roster, 2 * pick_limit)
+            state = BattleState(Player("Player", picks[:pick_limit]), Player("Computer", picks[pick_limit:]), damage=damage)
+            while state.winner is None:
+                state.step(policy(state))
+            turns += state.turns
+        best = max(best, turns / (time.perf_counter() - start))
+    return {"turns_per_second": result(best, "turns/s", "higher")}
+
+def _timed(function, repeat=1, setup=None, min_time=0.2) -> float:
+    '''
+    Best of at least repeat runs, which is the least disturbed by whatever
+    else the machine is doing. Quick functions are run again until they've
+    taken min_time in all (like timeit's autorange), since the best of a
+    handful of sub-millisecond runs is mostly noise.
+    '''
+    best = float('inf')
+    runs = 0
+    total = 0.0
+    # like timeit, keep the garbage collector from landing in some runs and not others
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        while runs < repeat or (total < min_time and runs < 10_000):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            best = min(best, elapsed)
+            total += elapsed
+            runs += 1
+    finally:
+        if collecting:
+            gc.enable()
+    return best
+
+def _load_db(filename):
+    # closed straight away, since _timed may open thousands of them
+    reader = PokemonManager(filename)
+    try:
+        reader.load_pokemon()
+    finally:
+        reader.store.close()
+
+def bench_io(sizes=(10, 100, 1_000, 10_000, 100_000)) -> dict:
+    '''
+    load_pokemon and save_pokemon against roster size, for a JSON roster read
+    without a snapshot, through a fresh snapshot and through one that has to
+    be compiled first, and for a SQLite roster
+    '''
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            repeat = 5 if size <= 1_000 else 3 if size <= 10_000 else 1
+            roster = synthetic_roster(size)
+            path = os.path.join(directory, f"roster-{size}.json")
+            manager = PokemonManager(path)
+            manager.pokemon = roster
+            results[f"save_json_{size}"] = result(_timed(manager.save_pokemon, repeat), "s", "lower")
+            load = lambda **kwargs: PokemonManager(path, **kwargs).load_pokemon()
+            results[f"load_json_{size}"] = result(_timed(lambda: load(snapshot=False), repeat), "s", "lower")
+            remove_snapshot = lambda: os.path.exists(snapshot_path(path)) and os.remove(snapshot_path(path))
+            results[f"load_json_compile_snapshot_{size}"] = result(_timed(load, repeat, remove_snapshot), "s", "lower")
+            results[f"load_json_snapshot_{size}"] = result(_timed(load, repeat), "s", "lower")
+
+            db = PokemonManager(os.path.join(directory, f"roster-{size}.db"))
+            db.pokemon = roster
+            results[f"save_db_{size}"] = result(_timed(db.save_pokemon, repeat), "s", "lower")
+            results[f"load_db_{size}"] = result(_timed(lambda: _load_db(db.filename), repeat), "s", "lower")
+            db.store.close()
+    return results
+
+def bench_ai(decisions=200, deadline=0.05, seed=0) -> dict:
+    ''' median and p99 time to choose a move, per difficulty, from positions partway through battles '''
+    rng = random.Random(seed)
+    roster = synthetic_roster(100, seed)
+    damage = DamageMatrix(roster)
+    positions = []
+    while len(positions) < decisions:
+        picks = rng.sample(roster, 6)
+        state = BattleState(Player("Player", picks[:3]), Player("Computer", picks[3:]), damage=damage)
+        for _ in range(rng.randrange(6)):
+            state.step(computer_action(state, 2, rng))
+            if state.over:
+                break
+        if not state.over and not state.replacing:
+            positions.append(state)
+
+    results = {}
+    for difficulty in range(1, MAX_DIFFICULTY + 1):
+        latencies = []
+        for state in positions:
+            # a fresh player each time and a single call, as in a battle: a
+            # player that has seen the position answers from its table
+            policy = computer_policy(difficulty, rng, deadline)
+            start = time.perf_counter()
+            policy(state)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        results[f"ai_{difficulty}_median"] = result(statistics.median(latencies) * 1000, "ms", "lower")
+        results[f"ai_{difficulty}_p99"] = result(latencies[int(0.99 * (len(latencies) - 1))] * 1000, "ms", "lower")
+    return results
+
+def bench_simulate(battles=20_000, workers=None, seed=0) -> dict:
+    ''' simulated battles per second for 1, 2, 4, ... workers up to the CPU count '''
+    if workers is None:
+        count = os.cpu_count() or 1
+        workers = sorted({1, count} | {2 ** i for i in range(count.bit_length()) if 2 ** i <= count})
+    roster = synthetic_roster(20, seed)
+    results = {}
+    for n in workers:
+        elapsed = _timed(lambda: simulate(roster, battles=battles, seed=seed, workers=n))
+        results[f"simulate_{n}_workers"] = result(battles / elapsed, "battles/s", "higher")
+    return results
+
+# timings closer than this to the baseline, in seconds, are never regressions:
+# a fraction of a millisecond is within what a busy machine adds
+NOISE_FLOOR = 0.001
+
+def compare(results, baseline, tolerance) -> list[str]:
+    ''' names of results more than tolerance (a fraction) worse than the baseline '''
+    regressions = []
+    for name, current in results.items():
+        old = baseline.get(name)
+        if old is None or not old["value"]:
+            continue
+        if current["unit"] == "s" and abs(current["value"] - old["value"]) < NOISE_FLOOR:
+            continue
+        change = (current["value"] - old["value"]) / old["value"]
+        if current["better"] == "lower":
+            change = -change
+        if change < -tolerance:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the battle loop, roster I/O, the computer's thinking time and the simulator.")
+    parser.add_argument('groups', nargs='*', help=f"benchmarks to run, any of {', '.join(GROUPS)} (default: all)")
+    parser.add_argument('--output', default="bench-results.json", help="file to write results to")
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results to --baseline instead of comparing")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="how much worse than the baseline counts as a regression (0.2 = 20%%)")
+    parser.add_argument('--quick', action='store_true', help="smaller rosters and fewer battles")
+    args = parser.parse_args()
+
+    groups = args.groups or GROUPS
+    for group in groups:
+        if group not in GROUPS:
+            parser.error(f"unknown benchmark {group}, choose from {', '.join(GROUPS)}")
+    results = {}
+    if "turns" in groups:
+        results.update(bench_turns(0.5 if args.quick else 2.0))
+    if "io" in groups:
+        results.update(bench_io((10, 100, 1_000) if args.quick else (10, 100, 1_000, 10_000, 100_000)))
+    if "ai" in groups:
+        results.update(bench_ai(50 if args.quick else 200))
+    if "simulate" in groups:
+        results.update(bench_simulate(2_000 if args.quick else 20_000))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if args.baseline and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    for name, current in results.items():
+        line = f"{name:36} {current['value']:12.4f} {current['unit']}"
+        if name in baseline and baseline[name]["value"]:
+            line += f"  ({(current['value'] - baseline[name]['value']) / baseline[name]['value']:+.1%} vs baseline)"
+        print(line)
+
+    if args.update_baseline:
+        if not args.baseline:
+            parser.error("--update-baseline needs --baseline")
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regressions of more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import csv
+import json
+import operator
+import sys
+
+from pokemon import FIELDS, BatchError, PokemonManager, iter_json_list
+
+# Rosters move in and out as a JSON list (.json), one JSON object per line
+# (.jsonl), or CSV (.csv) with a header of the roster's fields and the
+# attacks written as "name=damage; name=damage".
+
+OPERATORS = {
+    "<=": operator.le,
+    ">=": operator.ge,
+    "!=": operator.ne,
+    "=": operator.eq,
+    "<": operator.lt,
+    ">": operator.gt,
+}
+
+def _format(path) -> str:
+    for suffix in (".jsonl", ".json", ".csv"):
+        if path.endswith(suffix):
+            return suffix[1:]
+    raise ValueError(f"Don't know how to read or write {path}, use .json, .jsonl or .csv.")
+
+def parse_attacks(text: str) -> dict[str, str]:
+    attacks = {}
+    for part in text.split(";"):
+        if not part.strip():
+            continue
+        name, sep, damage = part.rpartition("=")
+        if not sep:
+            raise ValueError(f"attack {part.strip()!r} should be written name=damage")
+        attacks[name.strip()] = damage.strip()
+    return attacks
+
+def format_attacks(attacks: dict) -> str:
+    return "; ".join(f"{name}={damage}" for name, damage in attacks.items())
+
+def read_records(path):
+    ''' yields the raw records in a file, to be checked by PokemonManager.import_records '''
+    kind = _format(path)
+    with open(path, newline="" if kind == "csv" else None) as f:
+        if kind == "json":
+            yield from iter_json_list(f)
+        elif kind == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                # a bad attacks cell is left for validation to report
+                try:
+                    row["attacks"] = parse_attacks(row.get("attacks") or "")
+                except ValueError as e:
+                    row["attacks"] = str(e)
+                yield row
+
+def write_records(path, records) -> int:
+    kind = _format(path)
+    count = 0
+    with open(path, 'w', newline="" if kind == "csv" else None) as f:
+        if kind == "csv":
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+        elif kind == "json":
+            f.write("[")
+        for record in records:
+            if kind == "csv":
+                writer.writerow({**record, "attacks": format_attacks(record["attacks"])})
+            elif kind == "json":
+                f.write(("," if count else "") + "\n  " + json.dumps(record))
+            else:
+                f.write(json.dumps(record) + "\n")
+            count += 1
+        if kind == "json":
+            f.write("\n]\n")
+    return count
+
+def parse_filter(conditions: list[str]):
+    '''
+    a predicate from conditions like "type=fire", "health_points<100" or
+    "attacks>1" (the number of attacks); all of them have to hold
+    '''
+    checks = []
+    for condition in conditions:
+        for symbol, compare in OPERATORS.items():
+            field, sep, value = condition.partition(symbol)
+            if sep:
+                break
+        else:
+            raise ValueError(f"{condition!r} should look like field=value, with = != < <= > or >=")
+        field = field.strip()
+        if field not in FIELDS:
+            raise ValueError(f"unknown field {field!r}")
+        numeric = field in ("health_points", "stage", "attacks")
+        try:
+            value = int(value) if numeric else value.strip()
+        except ValueError:
+            raise ValueError(f"{field} is compared with a whole number, not {value!r}")
+        checks.append((field, compare, value))
+
+    def predicate(pokemon) -> bool:
+        for field, compare, value in checks:
+            actual = getattr(pokemon, field)
+            if field == "attacks":
+                actual = len(actual)
+            if not compare(actual, value):
+                return False
+        return True
+    return predicate
+
+def main():
+    parser = argparse.ArgumentParser(description="Import, export, patch and delete many pokemon at once, with one write per batch.")
+    parser.add_argument('--file', default="pokemon.json", help="roster to change")
+    commands = parser.add_subparsers(dest='command', required=True)
+    importing = commands.add_parser('import', help="add pokemon from a .json, .jsonl or .csv file, updating those already there")
+    importing.add_argument('source')
+    importing.add_argument('--replace', action='store_true', help="replace the whole roster instead")
+    exporting = commands.add_parser('export', help="write the roster, or the pokemon matching --where, to a .json, .jsonl or .csv file")
+    exporting.add_argument('target')
+    exporting.add_argument('--where', action='append', default=[], metavar='CONDITION')
+    patching = commands.add_parser('patch', help="apply edits from a JSON object of name -> {field: value}")
+    patching.add_argument('patches')
+    deleting = commands.add_parser('delete', help="delete the pokemon matching every --where")
+    deleting.add_argument('--where', action='append', required=True, metavar='CONDITION', help="e.g. type=fire or health_points<100")
+    args = parser.parse_args()
+
+    manager = PokemonManager(args.file)
+    try:
+        match args.command:
+            case 'import':
+                added, updated = manager.import_records(read_records(args.source), args.replace)
+                print(f"Added {added} and updated {updated} pokemon in {args.file}.")
+            case 'export':
+                predicate = parse_filter(args.where)
+                count = write_records(args.target, (p.to_record() for p in manager.pokemon if predicate(p)))
+                print(f"Exported {count} pokemon to {args.target}.")
+            case 'patch':
+                with open(args.patches) as f:
+                    changed = manager.patch(json.load(f))
+                print(f"Patched {changed} pokemon in {args.file}.")
+            case 'delete':
+                removed = manager.delete_where(parse_filter(args.where))
+                print(f"Deleted {len(removed)} pokemon from {args.file}.")
+    except BatchError as e:
+        sys.exit("Nothing was changed:\n" + "\n".join(f"  entry {error.index + 1} ({error.name or 'no name'}): {error.reason}" for error in e.errors))
+    except (ValueError, OSError) as e:
+        sys.exit(str(e))
+
+if __name__ == "__main__":
+    main()
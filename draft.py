@@ -0,0 +1,188 @@
+import itertools
+import math
+
+from pokemon import DamageMatrix, Pokemon, effective_damage
+
+class DraftAdvisor:
+    '''
+    Scores draft picks by expected win rate. The building block is the exact
+    chance that one pokemon beats another one-on-one when both attack at
+    random, as the computer does with nothing to swap to; those are cached per
+    pair. A team's score against another is its average over all pairings,
+    and a pick is chosen by searching the rest of the draft, both sides taking
+    turns, over the `breadth` most promising candidates `depth` picks deep.
+    '''
+
+    def __init__(self, roster: list[Pokemon], damage: DamageMatrix | None = None, breadth=6, depth=4):
+        self.roster = roster
+        self.damage = damage
+        self.breadth = breadth
+        self.depth = depth
+        self._matchups: dict[tuple[int, int], float] = {}
+        # rough strength used to order candidates before searching them
+        self.power = [
+            p.health_points * sum(p.attacks.values()) / max(1, len(p.attacks))
+            for p in roster
+        ]
+
+    def _damages(self, attacker: Pokemon, defender: Pokemon) -> tuple[int, ...]:
+        if self.damage is not None:
+            row = self.damage.rows[attacker.name][self.damage.profile_of[defender.name]]
+            return tuple(row.values())
+        return tuple(
+            effective_damage(damage, attacker.type, defender.weakness, defender.resistance)
+            for damage in attacker.attacks.values()
+        )
+
+    def matchup(self, i: int, j: int) -> float:
+        ''' chance roster[i] beats roster[j] one-on-one, averaged over who moves first '''
+        if (i, j) not in self._matchups:
+            a, b = self.roster[i], self.roster[j]
+            first, second = duel(a.health_points, b.health_points, self._damages(a, b), self._damages(b, a))
+            self._matchups[(i, j)] = (first + second) / 2
+            self._matchups[(j, i)] = 1 - self._matchups[(i, j)]
+        return self._matchups[(i, j)]
+
+    def team_score(self, mine, theirs) -> float:
+        if not mine or not theirs:
+            return 0.5
+        return sum(self.matchup(i, j) for i in mine for j in theirs) / (len(mine) * len(theirs))
+
+    def _ranking(self, pool, theirs) -> list[int]:
+        # candidates are ordered once per recommendation, against the other side's picks so far
+        def promise(i):
+            if theirs:
+                return sum(self.matchup(i, j) for j in theirs) / len(theirs)
+            return self.power[i]
+        return sorted(pool, key=promise, reverse=True)
+
+    def recommend(self, pool, mine, theirs, pick_limit) -> list[tuple[int, float]]:
+        '''
+        (pick, expected score) for the best candidates from pool when it's my
+        pick, best first. Picks alternate until both sides have pick_limit.
+        '''
+        pool = frozenset(pool)
+        ranked = (self._ranking(pool, theirs), self._ranking(pool, mine))
+        by_power = sorted(pool, key=lambda i: self.power[i], reverse=True)
+        memo = {}
+
+        def candidates(pool, my_turn):
+            return list(itertools.islice((i for i in ranked[not my_turn] if i in pool), self.breadth))
+
+        def complete(pool, mine, theirs, my_turn):
+            # past the search depth, both sides just take the strongest pokemon left
+            left = [i for i in by_power if i in pool]
+            mine, theirs = list(mine), list(theirs)
+            while left and (len(mine) < pick_limit or len(theirs) < pick_limit):
+                if my_turn and len(mine) < pick_limit or len(theirs) >= pick_limit:
+                    mine.append(left.pop(0))
+                else:
+                    theirs.append(left.pop(0))
+                my_turn = not my_turn
+            return self.team_score(mine, theirs)
+
+        def value(pool, mine, theirs, my_turn, depth):
+            if len(mine) >= pick_limit and len(theirs) >= pick_limit or not pool:
+                return self.team_score(mine, theirs)
+            if depth == 0:
+                return complete(pool, mine, theirs, my_turn)
+            key = (pool, mine, theirs, my_turn)
+            if key in memo:
+                return memo[key]
+            if my_turn and len(mine) >= pick_limit or not my_turn and len(theirs) >= pick_limit:
+                result = value(pool, mine, theirs, not my_turn, depth)
+            elif my_turn:
+                result = max(
+                    value(pool - {i}, mine | {i}, theirs, False, depth - 1)
+                    for i in candidates(pool, True)
+                )
+            else:
+                result = min(
+                    value(pool - {i}, mine, theirs | {i}, True, depth - 1)
+                    for i in candidates(pool, False)
+                )
+            memo[key] = result
+            return result
+
+        mine, theirs = frozenset(mine), frozenset(theirs)
+        scored = [
+            (i, value(pool - {i}, mine | {i}, theirs, False, self.depth - 1))
+            for i in candidates(pool, True)
+        ]
+        return sorted(scored, key=lambda item: item[1], reverse=True)
+
+    def pick(self, pool, mine, theirs, pick_limit) -> int:
+        return self.recommend(pool, mine, theirs, pick_limit)[0][0]
+
+# the most (hp of a, hp of b) positions duel() solves exactly, about 30 ms;
+# beyond that it estimates, since the advisor runs many duels per pick
+DUEL_CELLS = 5_000
+
+def _reachable(hp: int, damages, limit: int) -> list[int] | None:
+    ''' every hp above 0 that damages can leave a pokemon with, lowest first, or None if there are more than limit '''
+    hits = {d for d in damages if d > 0}
+    seen = {hp}
+    frontier = [hp]
+    while frontier:
+        left = frontier.pop()
+        for d in hits:
+            if left > d and left - d not in seen:
+                if len(seen) == limit:
+                    return None
+                seen.add(left - d)
+                frontier.append(left - d)
+    return sorted(seen)
+
+def _turns_to_ko(hp: int, damages) -> tuple[float, float]:
+    ''' mean and variance of the turns random attacks from damages take to do hp damage '''
+    mean = sum(damages) / len(damages)
+    variance = sum(d * d for d in damages) / len(damages) - mean * mean
+    if variance <= 0:
+        return math.ceil(hp / mean), 0.0
+    # renewal theory: about hp / mean hits, plus half a hit of overshoot
+    return hp / mean + 0.5, hp * variance / mean ** 3
+
+def estimate_duel(hp_a: int, hp_b: int, damage_a: tuple[int, ...], damage_b: tuple[int, ...]) -> tuple[float, float]:
+    '''
+    duel() for big hp, from normal approximations of how many turns each
+    side takes to knock the other out. a wins moving first if it needs no
+    more turns than b, and moving second if it needs fewer.
+    '''
+    if not any(damage_b):
+        return 1.0, 1.0
+    if not any(damage_a):
+        return 0.0, 0.0
+    mean_a, variance_a = _turns_to_ko(hp_b, damage_a)
+    mean_b, variance_b = _turns_to_ko(hp_a, damage_b)
+    spread = math.sqrt(2 * (variance_a + variance_b))
+    difference = mean_b - mean_a
+    if spread == 0:
+        return float(difference >= 0), float(difference > 0)
+    return 0.5 * (1 + math.erf((difference + 0.5) / spread)), 0.5 * (1 + math.erf((difference - 0.5) / spread))
+
+def duel(hp_a: int, hp_b: int, damage_a: tuple[int, ...], damage_b: tuple[int, ...]) -> tuple[float, float]:
+    '''
+    Exact chance that a beats b one-on-one when each picks one of its attacks
+    at random every turn: (a moving first, b moving first). A pokemon with
+    no attacks never does any damage. Above DUEL_CELLS positions it's
+    estimate_duel() instead.
+    '''
+    # x: a wins with a to move, y: a wins with b to move. Attacks that do no
+    # damage leave the hp as they are, so x and y depend on each other.
+    stay_a = damage_a.count(0) / len(damage_a) if damage_a else 1.0
+    stay_b = damage_b.count(0) / len(damage_b) if damage_b else 1.0
+    if stay_a * stay_b == 1:
+        return 0.5, 0.5
+    reach_a = _reachable(hp_a, damage_b, DUEL_CELLS)
+    reach_b = reach_a and _reachable(hp_b, damage_a, DUEL_CELLS // len(reach_a))
+    if not reach_b:
+        return estimate_duel(hp_a, hp_b, damage_a, damage_b)
+    # solved from the lowest hp up, since every hit only leads to lower hp
+    x, y = {}, {}
+    for a in reach_a:
+        for b in reach_b:
+            rest_a = sum(1.0 if b <= d else y[(a, b - d)] for d in damage_a if d) / len(damage_a) if damage_a else 0.0
+            rest_b = sum(0.0 if a <= d else x[(a - d, b)] for d in damage_b if d) / len(damage_b) if damage_b else 0.0
+            x[(a, b)] = (rest_a + stay_a * rest_b) / (1 - stay_a * stay_b)
+            y[(a, b)] = rest_b + stay_b * x[(a, b)]
+    return x[(hp_a, hp_b)], y[(hp_a, hp_b)]
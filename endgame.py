@@ -0,0 +1,204 @@
+from collections import OrderedDict
+
+from engine import BattleState, attack_chance
+
+class EndgameSolver:
+    '''
+    Exact chance that side 0 wins once both sides are down to `max_alive`
+    pokemon or fewer, when both pick their moves like computer_action does:
+    attack with a random attack, or swap to a random pokemon, with the chance
+    of attacking set by the difficulty, and replace a fainted pokemon with the
+    first one left.
+
+    Positions are solved one set of hp at a time, from the lowest hp up.
+    Within a set of hp the positions (active pokemon, side to move) depend on
+    each other through swaps and attacks that do no damage, so they're solved
+    together as a small linear system. Positions that can reach more than
+    `max_states` sets of hp aren't solved, and are remembered as too big.
+    Solutions are cached per matchup and shared by every battle using the
+    solver, dropping the least recently used matchups once more than
+    `cache_size` sets are kept. A solver isn't thread-safe: the simulator
+    gives each worker process its own, and threads should do the same.
+    '''
+
+    def __init__(self, max_alive=2, max_states=1_000, cache_size=200_000):
+        self.max_alive = max_alive
+        self.max_states = max_states
+        self.cache_size = cache_size
+        # (damage table, attack chances) -> {hp: {position: chance}}
+        self.cache: OrderedDict = OrderedDict()
+        self._size = 0
+
+    def damages(self, state: BattleState) -> list:
+        ''' damages[side][attacker][defender]: the damage of each attack, as chance() takes them '''
+        return [
+            [
+                [[state.attack_damage(attacker, defender, name) for name in attacker.attacks] for defender in state.sides[1 - s].pokemon]
+                for attacker in side.pokemon
+            ]
+            for s, side in enumerate(state.sides)
+        ]
+
+    def win_chance(self, state: BattleState, difficulties=(2, 2), damages=None) -> float | None:
+        '''
+        chance side 0 wins from state, or None when it's too big to solve.
+        Pass damages from damages(state) when asking about the same battle again.
+        '''
+        sides = state.sides
+        return self.chance(
+            damages or self.damages(state),
+            (tuple(sides[0].hp), tuple(sides[1].hp)),
+            (sides[0].active_index, sides[1].active_index),
+            state.to_move,
+            (attack_chance(difficulties[0]), attack_chance(difficulties[1])),
+        )
+
+    def chance(self, damages, hp, actives, mover, chances) -> float | None:
+        '''
+        The same from raw tables: damages[side][attacker][defender] lists the
+        damage of each attack, hp and actives are per side, and chances[side]
+        is how likely that side is to attack when it could swap.
+        '''
+        alive = [[i for i, h in enumerate(side) if h] for side in hp]
+        if not alive[0] or not alive[1]:
+            return float(bool(alive[0]))
+        if len(alive[0]) > self.max_alive or len(alive[1]) > self.max_alive:
+            return None
+        # only the pokemon still standing matter, renumbered in team order
+        table = tuple(
+            tuple(
+                tuple(tuple(damages[s][i][j]) for j in alive[1 - s])
+                for i in alive[s]
+            )
+            for s in (0, 1)
+        )
+        start = (tuple(hp[0][i] for i in alive[0]), tuple(hp[1][i] for i in alive[1]))
+        solution = self._solve((table, tuple(chances)), start)
+        if not solution:
+            return None
+        # a fainted active pokemon is about to be replaced by the first one left
+        position = tuple(
+            alive[s].index(actives[s]) if hp[s][actives[s]] else 0
+            for s in (0, 1)
+        ) + (mover,)
+        return solution[position]
+
+    def _solve(self, key, start):
+        solved = self.cache.get(key)
+        if solved is None:
+            solved = self.cache[key] = {}
+        self.cache.move_to_end(key)
+        if start in solved:
+            return solved[start]
+        table, chances = key
+        before = len(solved)
+        # every set of hp reachable from start that isn't solved yet, unless there are too many
+        reachable = {start}
+        frontier = [start]
+        while frontier and len(reachable) <= self.max_states:
+            for child in self._children(table, frontier.pop()):
+                if child not in solved and child not in reachable:
+                    reachable.add(child)
+                    frontier.append(child)
+                elif solved.get(child, 0) is None:
+                    # a set too big to solve makes everything above it too big as well
+                    reachable.clear()
+                    frontier.clear()
+                    break
+        if not reachable or len(reachable) > self.max_states:
+            solved[start] = None
+        else:
+            # attacks only ever lower hp, so going from the lowest total up every child is solved first
+            for hp in sorted(reachable, key=lambda hp: sum(hp[0]) + sum(hp[1])):
+                solved[hp] = self._solve_hp(table, chances, hp, solved)
+        self._size += len(solved) - before
+        while self._size > self.cache_size and len(self.cache) > 1:
+            _, dropped = self.cache.popitem(last=False)
+            self._size -= len(dropped)
+        return solved[start]
+
+    def _moves(self, table, chances, hp, actives, mover):
+        '''
+        (probability, outcome) for each move from a position, where outcome is
+        a win for side 0 (1.0) or 1 (0.0), or the (hp, position) it leads to
+        '''
+        own, other = hp[mover], hp[1 - mover]
+        active, target = actives[mover], actives[1 - mover]
+        others = [i for i, h in enumerate(own) if h and i != active]
+        attack = chances[mover] if others else 1.0
+        damages = table[mover][active][target]
+        moves = []
+        for damage in damages:
+            left = max(0, other[target] - damage)
+            other_hp = other[:target] + (left,) + other[target + 1:]
+            new_hp = (own, other_hp) if mover == 0 else (other_hp, own)
+            new_target = target
+            if not left:
+                standing = [i for i, h in enumerate(other_hp) if h]
+                if not standing:
+                    moves.append((attack / len(damages), float(mover == 0)))
+                    continue
+                new_target = standing[0]
+            new_actives = (active, new_target) if mover == 0 else (new_target, active)
+            moves.append((attack / len(damages), (new_hp, new_actives + (1 - mover,))))
+        for i in others:
+            new_actives = (i, target) if mover == 0 else (target, i)
+            moves.append(((1 - attack) / len(others), (hp, new_actives + (1 - mover,))))
+        return moves
+
+    def _positions(self, hp):
+        return [
+            (a, b, mover)
+            for a, h in enumerate(hp[0]) if h
+            for b, g in enumerate(hp[1]) if g
+            for mover in (0, 1)
+        ]
+
+    def _children(self, table, hp):
+        children = set()
+        for a, b, mover in self._positions(hp):
+            for _, outcome in self._moves(table, (0.5, 0.5), hp, (a, b), mover):
+                if isinstance(outcome, tuple) and outcome[0] != hp:
+                    children.add(outcome[0])
+        return children
+
+    def _solve_hp(self, table, chances, hp, solved):
+        positions = self._positions(hp)
+        index = {position: i for i, position in enumerate(positions)}
+        n = len(positions)
+        # rows of [coefficients..., constant] for x = sum(p * outcome)
+        rows = []
+        for position in positions:
+            row = [0.0] * (n + 1)
+            row[index[position]] = 1.0
+            for p, outcome in self._moves(table, chances, hp, position[:2], position[2]):
+                if not isinstance(outcome, tuple):
+                    row[n] += p * outcome
+                elif outcome[0] == hp:
+                    row[index[outcome[1]]] -= p
+                elif solved[outcome[0]]:
+                    row[n] += p * solved[outcome[0]][outcome[1]]
+                else:
+                    # leads somewhere nobody can ever win
+                    return {}
+            rows.append(row)
+        values = _gauss(rows)
+        if values is None:
+            # nobody can ever win, no attack left does any damage
+            return {}
+        return dict(zip(positions, values))
+
+def _gauss(rows) -> list[float] | None:
+    ''' solves the system in place with partial pivoting, None when it's singular '''
+    n = len(rows)
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(n):
+            if r != col and rows[r][col]:
+                factor = rows[r][col] / rows[col][col]
+                for c in range(col, n + 1):
+                    rows[r][c] -= factor * rows[col][c]
+    return [rows[i][n] / rows[i][i] for i in range(n)]
@@ -0,0 +1,171 @@
+import random
+from array import array
+from dataclasses import dataclass
+
+import metrics
+from pokemon import DamageMatrix, effective_damage
+
+PLAYER = 0
+COMPUTER = 1
+
+class Player:
+    __slots__ = ('name', 'pokemon', 'hp', 'active_index')
+
+    def __init__(self, name, pokemon):
+        self.name = name
+        # the species are shared with the roster and never changed by a battle,
+        # the battle's own state is just the hp of each team slot
+        self.pokemon = pokemon
+        self.hp = array('I', (int(p.health_points) for p in pokemon))
+        self.active_index = 0
+
+    @property
+    def active_pokemon(self):
+        return self.pokemon[self.active_index]
+
+    @property
+    def active_hp(self):
+        return self.hp[self.active_index]
+
+    def is_alive(self, index):
+        return self.hp[index] > 0
+
+    def has_alive_pokemon(self):
+        return any(self.hp)
+
+    def swap_pokemon(self, index):
+        if 0 <= index < len(self.pokemon) and self.hp[index] > 0:
+            self.active_index = index
+            return True
+        return False
+
+# Actions a side can submit to BattleState.step()
+@dataclass(frozen=True)
+class Attack:
+    name: str
+
+@dataclass(frozen=True)
+class Swap:
+    index: int
+
+@dataclass(frozen=True)
+class Forfeit:
+    pass
+
+@dataclass
+class Event:
+    kind: str  # 'attack', 'swap', 'fainted', 'sent_out', 'forfeit' or 'win'
+    side: int
+    pokemon: str = ""
+    attack: str | None = None
+    damage: int = 0
+
+class BattleState:
+    ''' rules of a battle between two sides, with no terminal I/O '''
+
+    def __init__(self, player: Player, computer: Player, first: int = PLAYER, damage: DamageMatrix | None = None):
+        self.sides = (player, computer)
+        # precomputed damage for the roster the teams were drafted from, if there is one
+        self.damage = damage
+        self.to_move = first
+        # set when the side to move has to replace a fainted pokemon before taking its turn
+        self.replacing = False
+        self.winner: int | None = None
+        self.turns = 0
+        # anything with a record(state, side, action) method, e.g. a replay.BattleLog
+        self.recorder = None
+
+    @property
+    def over(self) -> bool:
+        return self.winner is not None
+
+    def attack_damage(self, attacker, defender, attack: str) -> int:
+        if self.damage is not None:
+            return self.damage.damage(attacker, defender, attack)
+        return effective_damage(attacker.attacks[attack], attacker.type, defender.weakness, defender.resistance)
+
+    def legal_actions(self) -> list:
+        if self.over:
+            return []
+        side = self.sides[self.to_move]
+        swaps = [
+            Swap(i) for i, hp in enumerate(side.hp)
+            if hp > 0 and i != side.active_index
+        ]
+        if self.replacing:
+            return swaps
+        return [Attack(name) for name in side.active_pokemon.attacks] + swaps + [Forfeit()]
+
+    def step(self, action) -> list[Event]:
+        mover = self.to_move
+        events = self._apply(action)
+        if self.recorder is not None:
+            self.recorder.record(self, mover, action)
+        if metrics.active is not None:
+            metrics.active.battle_events(events)
+        return events
+
+    def _apply(self, action) -> list[Event]:
+        if self.over:
+            raise ValueError("The battle is already over.")
+        mover = self.to_move
+        side = self.sides[mover]
+
+        if self.replacing:
+            if not isinstance(action, Swap) or not side.swap_pokemon(action.index):
+                raise ValueError(f"{side.name} must send out a pokemon that has not fainted.")
+            # a replacement doesn't use up the turn
+            self.replacing = False
+            return [Event('sent_out', mover, side.active_pokemon.name)]
+
+        if isinstance(action, Attack):
+            attacker = side.active_pokemon
+            if action.name not in attacker.attacks:
+                raise ValueError(f"{attacker.name} doesn't know {action.name}.")
+            defending_side = 1 - mover
+            defender = self.sides[defending_side]
+            damage = self.attack_damage(attacker, defender.active_pokemon, action.name)
+            target = defender.active_index
+            defender.hp[target] = max(0, defender.hp[target] - damage)
+            events = [Event('attack', mover, attacker.name, action.name, damage)]
+            if not defender.hp[target]:
+                events.append(Event('fainted', defending_side, defender.active_pokemon.name))
+                if not defender.has_alive_pokemon():
+                    self.winner = mover
+                    events.append(Event('win', mover))
+                    return events
+                self.replacing = True
+        elif isinstance(action, Swap):
+            if action.index == side.active_index or not side.swap_pokemon(action.index):
+                raise ValueError("Invalid choice or Pokemon is fainted.")
+            events = [Event('swap', mover, side.active_pokemon.name)]
+        elif isinstance(action, Forfeit):
+            self.winner = 1 - mover
+            return [Event('forfeit', mover), Event('win', self.winner)]
+        else:
+            raise ValueError(f"Unknown action {action!r}.")
+
+        self.turns += 1
+        self.to_move = 1 - mover
+        return events
+
+def attack_chance(difficulty) -> float:
+    ''' how likely computer_action is to attack when it could also swap '''
+    return min(1.0, 0.5 + 0.1 * difficulty)
+
+def computer_action(state: BattleState, difficulty=2, rng=random):
+    ''' the computer's policy: attack more often the higher the difficulty, else swap at random '''
+    side = state.sides[state.to_move]
+    alive = [i for i, hp in enumerate(side.hp) if hp > 0]
+    if state.replacing:
+        return Swap(alive[0])
+    available_pokemon = [i for i in alive if i != side.active_index]
+    if rng.random() < attack_chance(difficulty) or not available_pokemon:
+        return Attack(rng.choice(list(side.active_pokemon.attacks)))
+    return Swap(rng.choice(available_pokemon))
+
+def play(state: BattleState, policies) -> int:
+    ''' runs a battle to the end, asking policies[side](state) for each action; returns the winner '''
+    while state.winner is None:
+        state.step(policies[state.to_move](state))
+    return state.winner
@@ -0,0 +1,168 @@
+import random
+
+import numpy as np
+
+from ai import BATCH_NODES, computer_policy
+from engine import PLAYER, Attack, BattleState, Player, Swap, computer_action
+from pokemon import DamageMatrix, Pokemon, normal_type
+
+# attack damage is divided by this in observations, to keep them around 0-1
+DAMAGE_SCALE = 200.0
+
+class BattleEnv:
+    '''
+    Gym-style environment over the battle rules, with the agent playing
+    side 0 against a computer of the given difficulty (or any callable(state)
+    -> action). Every reset drafts two random teams of pick_limit from the
+    roster.
+
+    Actions are numbers: 0 to max_attacks - 1 use the active pokemon's attack
+    in that position, and max_attacks + i swaps to (or, after a faint, sends
+    out) team slot i. action_mask() says which are legal right now, and is
+    also returned in every info. The reward is 1 for a win, -1 for a loss and
+    0 otherwise; battles still going after max_turns are truncated.
+
+    The observation is a flat float32 vector: for each side, own first and
+    slot by slot, the hp fraction, whether it's active, one-hot type,
+    weakness and resistance, and attack damage / DAMAGE_SCALE padded to
+    max_attacks; then whether the agent has to send out a pokemon.
+    '''
+
+    def __init__(self, roster: list[Pokemon], pick_limit=3, opponent=2, damage: DamageMatrix | None = None, seed=None, max_turns=200):
+        if 2 * pick_limit > len(roster):
+            raise ValueError(f"A roster of {len(roster)} pokemon can't field two teams of {pick_limit}.")
+        self.roster = list(roster)
+        self.pick_limit = pick_limit
+        self.damage = damage if damage is not None else DamageMatrix(self.roster)
+        self.max_turns = max_turns
+        self.rng = random.Random(seed)
+        # a node budget rather than a clock, so the same seed gives the same episodes
+        self.opponent = computer_policy(opponent, self.rng, deadline=None, max_nodes=BATCH_NODES) if isinstance(opponent, int) else opponent
+        self.max_attacks = max(len(p.attacks) for p in self.roster)
+        self.n_actions = self.max_attacks + pick_limit
+        types = {normal_type(value) for p in self.roster for value in (p.type, p.weakness, p.resistance)}
+        types.discard("")
+        self.types = {t: i for i, t in enumerate(sorted(types))}
+        self.slot_size = 2 + 3 * len(self.types) + self.max_attacks
+        self.observation_size = 2 * pick_limit * self.slot_size + 1
+        # the static part of each species' encoding, filled into observations as is
+        self._species = {id(p): self._encode(p) for p in self.roster}
+        self.state: BattleState | None = None
+
+    def _encode(self, pokemon) -> np.ndarray:
+        encoded = np.zeros(self.slot_size - 2, dtype=np.float32)
+        n = len(self.types)
+        for offset, value in enumerate((pokemon.type, pokemon.weakness, pokemon.resistance)):
+            index = self.types.get(normal_type(value))
+            if index is not None:
+                encoded[offset * n + index] = 1.0
+        damages = list(pokemon.attacks.values())
+        encoded[3 * n:3 * n + len(damages)] = np.array(damages, dtype=np.float32) / DAMAGE_SCALE
+        return encoded
+
+    def reset(self, seed=None, teams=None) -> tuple[np.ndarray, dict]:
+        ''' a new battle, drafted at random unless teams gives (agent's, computer's) lists of roster indices '''
+        if seed is not None:
+            self.rng.seed(seed)
+        if teams is None:
+            picks = self.rng.sample(range(len(self.roster)), 2 * self.pick_limit)
+            teams = (picks[:self.pick_limit], picks[self.pick_limit:])
+        player = Player("Agent", [self.roster[i] for i in teams[0]])
+        computer = Player("Computer", [self.roster[i] for i in teams[1]])
+        self.state = BattleState(player, computer, first=self.rng.randrange(2), damage=self.damage)
+        self._opponent_moves()
+        return self.observation(), self._info()
+
+    def step(self, action: int) -> tuple[np.ndarray, float, bool, bool, dict]:
+        state = self.state
+        if state is None or state.over:
+            raise ValueError("The battle is over, call reset().")
+        if not self.action_mask()[action]:
+            raise ValueError(f"Action {action} isn't legal now.")
+        if action < self.max_attacks:
+            state.step(Attack(list(state.sides[PLAYER].active_pokemon.attacks)[action]))
+        else:
+            state.step(Swap(action - self.max_attacks))
+        self._opponent_moves()
+        reward = 0.0
+        if state.over:
+            reward = 1.0 if state.winner == PLAYER else -1.0
+        truncated = not state.over and state.turns >= self.max_turns
+        return self.observation(), reward, state.over, truncated, self._info()
+
+    def _opponent_moves(self):
+        state = self.state
+        while not state.over and state.to_move != PLAYER:
+            if state.replacing:
+                state.step(computer_action(state, rng=self.rng))
+            else:
+                state.step(self.opponent(state))
+
+    def action_mask(self) -> np.ndarray:
+        mask = np.zeros(self.n_actions, dtype=bool)
+        state = self.state
+        if state is None or state.over:
+            return mask
+        side = state.sides[PLAYER]
+        if not state.replacing:
+            mask[:len(side.active_pokemon.attacks)] = True
+        for i, hp in enumerate(side.hp):
+            if hp and i != side.active_index:
+                mask[self.max_attacks + i] = True
+        return mask
+
+    def observation(self) -> np.ndarray:
+        obs = np.zeros(self.observation_size, dtype=np.float32)
+        state = self.state
+        for s, side in enumerate((state.sides[PLAYER], state.sides[1 - PLAYER])):
+            for i, pokemon in enumerate(side.pokemon):
+                start = (s * self.pick_limit + i) * self.slot_size
+                obs[start] = side.hp[i] / pokemon.health_points
+                obs[start + 1] = i == side.active_index
+                obs[start + 2:start + self.slot_size] = self._species[id(pokemon)]
+        obs[-1] = state.replacing and state.to_move == PLAYER
+        return obs
+
+    def _info(self) -> dict:
+        return {"action_mask": self.action_mask(), "turns": self.state.turns}
+
+class VectorBattleEnv:
+    '''
+    n BattleEnvs stepped together, returning stacked arrays. A battle that
+    ends is reset straight away, so every row always has a battle to act in;
+    the observation it ended with is in info["final_observation"] for that row.
+    '''
+
+    def __init__(self, n: int, roster: list[Pokemon], pick_limit=3, opponent=2, seed=None, max_turns=200):
+        damage = DamageMatrix(roster)
+        seeds = random.Random(seed)
+        self.envs = [
+            BattleEnv(roster, pick_limit, opponent, damage, seeds.randrange(2**32), max_turns)
+            for _ in range(n)
+        ]
+        self.n_actions = self.envs[0].n_actions
+        self.observation_size = self.envs[0].observation_size
+
+    def reset(self, seed=None) -> tuple[np.ndarray, dict]:
+        seeds = random.Random(seed) if seed is not None else None
+        results = [env.reset(seeds.randrange(2**32) if seeds else None) for env in self.envs]
+        return np.stack([obs for obs, _ in results]), {"action_mask": np.stack([info["action_mask"] for _, info in results])}
+
+    def action_mask(self) -> np.ndarray:
+        return np.stack([env.action_mask() for env in self.envs])
+
+    def step(self, actions) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict]:
+        n = len(self.envs)
+        obs = np.empty((n, self.observation_size), dtype=np.float32)
+        rewards = np.zeros(n, dtype=np.float32)
+        terminated = np.zeros(n, dtype=bool)
+        truncated = np.zeros(n, dtype=bool)
+        masks = np.empty((n, self.n_actions), dtype=bool)
+        final = {}
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            obs[i], rewards[i], terminated[i], truncated[i], info = env.step(int(action))
+            if terminated[i] or truncated[i]:
+                final[i] = obs[i].copy()
+                obs[i], info = env.reset()
+            masks[i] = info["action_mask"]
+        return obs, rewards, terminated, truncated, {"action_mask": masks, "final_observation": final}
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from simulate import MAX_TURNS
+
+# Clients for a running server.py on localhost: sessions that connect and sit
+# idle, battles against the computer and PvP pairs, all at once. Every client
+# picks and moves at random, and times each command it sends until the server
+# next asks it for something (draft, turn or over), which for a battle against
+# the computer includes the computer's move.
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        client = cls(*await asyncio.open_connection(host, port))
+        await client.receive()  # hello
+        return client
+
+    def send(self, line):
+        self.writer.write((line + "\n").encode())
+
+    async def receive(self) -> dict:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("the server closed the connection")
+        return json.loads(line)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def play(client, command, rng, latencies) -> dict:
+    '''
+    sends command (PLAY or JOIN, or None if it's been sent already), then
+    drafts and battles at random until the battle is over, adding the time of
+    every command to latencies; returns the "over" message
+    '''
+    if command is not None:
+        client.send(command)
+    sent = time.perf_counter()
+    turns = 0
+    while True:
+        message = await client.receive()
+        match message["type"]:
+            case "draft":
+                latencies.append(time.perf_counter() - sent)
+                client.send(f"PICK {rng.choice(message['pool'])}")
+                sent = time.perf_counter()
+            case "turn":
+                latencies.append(time.perf_counter() - sent)
+                # forfeiting would end most battles on the first few turns, but
+                # some can't end any other way, e.g. pokemon that can't hurt each other
+                turns += 1
+                actions = [a for a in message["actions"] if a != "FORFEIT" or turns > MAX_TURNS]
+                client.send(rng.choice(actions))
+                sent = time.perf_counter()
+            case "over":
+                latencies.append(time.perf_counter() - sent)
+                return message
+            case "error":
+                raise RuntimeError(message["message"])
+
+async def run(host, port, idle, battles, pairs, pick_limit, difficulty, seed) -> dict:
+    rng = random.Random(seed)
+    idlers = [await Client.connect(host, port) for _ in range(idle)]
+    latencies = []
+
+    async def computer_battle(i):
+        client = await Client.connect(host, port)
+        try:
+            return await play(client, f"PLAY {pick_limit} {difficulty}", random.Random(rng.random()), latencies)
+        finally:
+            await client.close()
+
+    async def pvp_battle(i):
+        first, second = await Client.connect(host, port), await Client.connect(host, port)
+        try:
+            room = f"load-{seed}-{i}"
+            # the second JOIN must come after the first, or both would wait in the room
+            first.send(f"JOIN {room} {pick_limit}")
+            assert (await first.receive())["type"] == "waiting"
+            return await asyncio.gather(
+                play(second, f"JOIN {room}", random.Random(rng.random()), latencies),
+                play(first, None, random.Random(rng.random()), latencies),
+            )
+        finally:
+            await first.close()
+            await second.close()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(computer_battle(i) for i in range(battles)),
+        *(pvp_battle(i) for i in range(pairs)),
+    )
+    elapsed = time.perf_counter() - start
+
+    # the idle sessions should have outlived all of that; any command will do,
+    # a connected session answers this one with an error
+    for client in idlers:
+        client.send("HELP")
+    alive = 0
+    for client in idlers:
+        try:
+            if (await client.receive())["type"] == "error":
+                alive += 1
+        except ConnectionError:
+            pass
+        await client.close()
+
+    latencies.sort()
+    return {
+        "battles": len(results),
+        "idle_alive": alive,
+        "seconds": elapsed,
+        "median_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99_ms": latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running battle server with localhost clients.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--idle', type=int, default=2000, help="sessions that connect and do nothing (may need a higher ulimit -n)")
+    parser.add_argument('--battles', type=int, default=200, help="concurrent battles against the computer")
+    parser.add_argument('--pairs', type=int, default=1, help="concurrent player-vs-player battles")
+    parser.add_argument('--pick-limit', type=int, default=2)
+    parser.add_argument('--difficulty', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.host, args.port, args.idle, args.battles, args.pairs, args.pick_limit, args.difficulty, args.seed))
+    print(f"{report['battles']} battles in {report['seconds']:.1f} s, {report['idle_alive']}/{args.idle} idle sessions still connected")
+    print(f"turn latency: median {report['median_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import cProfile
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Opt-in counters and latency histograms. Nothing is collected until enable()
+# is called: the hooks in the engine, the battle loop and the manager check
+# `metrics.active` first, so while it's None they cost one attribute lookup.
+
+# upper bounds, in seconds, of the latency histogram buckets
+TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DAMAGE_BUCKETS = (0, 10, 25, 50, 75, 100, 150, 200, 300, 500)
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # one more count than buckets, for values above the last one
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    ''' counters and histograms, each keyed by a name and optional labels '''
+
+    def __init__(self):
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def battle_events(self, events):
+        ''' counts what a BattleState.step did from the events it returned '''
+        for event in events:
+            match event.kind:
+                case 'attack':
+                    self.count("battle_turns_total")
+                    self.count("battle_damage_total", event.damage)
+                    self.observe("battle_attack_damage", event.damage, DAMAGE_BUCKETS)
+                case 'swap':
+                    self.count("battle_turns_total")
+                    self.count("battle_swaps_total")
+                case 'fainted':
+                    self.count("battle_faints_total")
+                case 'forfeit':
+                    self.count("battle_forfeits_total")
+                case 'win':
+                    self.count("battles_total")
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name, "labels": dict(labels), "buckets": list(h.buckets),
+                        "counts": list(h.counts), "sum": h.sum, "count": h.count,
+                    }
+                    for (name, labels), h in sorted(self.histograms.items())
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        ''' the Prometheus text exposition format '''
+        def series(name, labels, extra=()):
+            pairs = [f'{key}="{value}"' for key, value in (*labels, *extra)]
+            return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{series(name, labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                total = 0
+                for bound, count in zip((*h.buckets, "+Inf"), h.counts):
+                    total += count
+                    lines.append(f"{series(name + '_bucket', labels, [('le', bound)])} {total}")
+                lines.append(f"{series(name + '_sum', labels)} {h.sum}")
+                lines.append(f"{series(name + '_count', labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        ''' JSON for a .json file, Prometheus text for anything else '''
+        with open(path, 'w') as f:
+            if path.endswith(".json"):
+                json.dump(self.to_dict(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+    def serve(self, host="127.0.0.1", port=9100) -> ThreadingHTTPServer:
+        ''' serves /metrics (Prometheus text) and /metrics.json from a background thread '''
+        collected = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, kind = collected.to_prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, kind = json.dumps(collected.to_dict()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# the metrics being collected, or None while they're off
+active: Metrics | None = None
+_off = nullcontext()
+
+def enable() -> Metrics:
+    global active
+    if active is None:
+        active = Metrics()
+    return active
+
+def disable():
+    global active
+    active = None
+
+def timer(name, **labels):
+    ''' times a with block into the active metrics, or does nothing while they're off '''
+    return active.timer(name, **labels) if active is not None else _off
+
+def count(name, amount=1, **labels):
+    if active is not None:
+        active.count(name, amount, **labels)
+
+@contextmanager
+def profiled(path):
+    ''' runs the with block under cProfile and dumps the stats to path, for pstats or snakeviz '''
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
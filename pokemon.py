@@ -1,9 +1,31 @@
+import argparse
+import difflib
+import itertools
 import json
 import os
-from dataclasses import dataclass
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import asdict, dataclass
 from typing import List
 
-@dataclass
+import metrics
+from results import ResultCache, record_hash, results_path
+from snapshot import Snapshot, open_snapshot
+from store import SqliteStore
+
+FIELDS = (
+    "name",
+    "type",
+    "health_points",
+    "stage",
+    "attacks",
+    "weakness",
+    "resistance",
+)
+
+@dataclass(slots=True)
 class Pokemon:
     name: str
     type: str
@@ -13,97 +35,774 @@ class Pokemon:
     weakness: str
     resistance: str | None
 
-    def __post_init__(self, **args):
-        self.hp = self.health_points
-        self.max_hp = self.health_points
+    def to_record(self) -> dict:
+        return {key: getattr(self, key) for key in FIELDS}
+
+WEAKNESS_MULTIPLIER = 2
+RESISTANCE_REDUCTION = 30
 
-    def is_alive(self):
-        return self.hp > 0
+def normal_type(value: str | None) -> str:
+    return (value or "").strip().lower()
 
-    def take_damage(self, damage):
-        self.hp = max(0, int(self.hp) - int(damage))
+def effective_damage(damage: int, attack_type: str, weakness: str, resistance: str | None) -> int:
+    ''' attacks are of their pokemon's type: double against a weakness, 30 less against a resistance '''
+    attack_type = normal_type(attack_type)
+    if not attack_type:
         return damage
+    if attack_type == normal_type(weakness):
+        damage *= WEAKNESS_MULTIPLIER
+    if attack_type == normal_type(resistance):
+        damage = max(0, damage - RESISTANCE_REDUCTION)
+    return damage
+
+class DamageMatrix:
+    '''
+    Effective damage of every attack in the roster against every defender.
+    Defenders with the same weakness and resistance take the same damage, so
+    they share a column and the table grows with species x distinct
+    weakness/resistance pairs rather than species x species.
+    '''
+
+    def __init__(self, roster: List[Pokemon] = ()):
+        self.profiles: dict[tuple[str, str], int] = {}
+        self.profile_of: dict[str, int] = {}
+        self.attackers: dict[str, Pokemon] = {}
+        # attacker name -> one {attack: damage} per profile
+        self.rows: dict[str, list[dict[str, int]]] = {}
+        for pokemon in roster:
+            self.update(pokemon)
+
+    def _cell(self, attacker, profile):
+        return {
+            attack: effective_damage(damage, attacker.type, *profile)
+            for attack, damage in attacker.attacks.items()
+        }
+
+    def _profile(self, pokemon) -> int:
+        key = (normal_type(pokemon.weakness), normal_type(pokemon.resistance))
+        profile = self.profiles.get(key)
+        if profile is None:
+            profile = self.profiles[key] = len(self.profiles)
+            for name, attacker in self.attackers.items():
+                self.rows[name].append(self._cell(attacker, key))
+        return profile
+
+    def update(self, pokemon: Pokemon, old_name: str | None = None):
+        ''' (re)computes the row and column of one species, e.g. after it was added or edited '''
+        if old_name is not None:
+            self.remove(old_name)
+        self.profile_of[pokemon.name] = self._profile(pokemon)
+        self.attackers[pokemon.name] = pokemon
+        self.rows[pokemon.name] = [self._cell(pokemon, key) for key in self.profiles]
+
+    def remove(self, name: str):
+        self.attackers.pop(name, None)
+        self.rows.pop(name, None)
+        self.profile_of.pop(name, None)
+
+    def damage(self, attacker: Pokemon, defender: Pokemon, attack: str) -> int:
+        return self.rows[attacker.name][self.profile_of[defender.name]][attack]
+
+class SpeciesTable:
+    '''
+    Read-only struct-of-arrays copy of a roster. Species, types and attacks
+    are referred to by their index; battles keep only their own HP arrays.
+    '''
+    __slots__ = (
+        'names', 'types', 'attack_names', 'type_ids', 'health_points', 'stage',
+        'weakness_ids', 'resistance_ids', 'attack_start', 'attack_ids', 'attack_damage', '_index',
+    )
+
+    def __init__(self, roster: List[Pokemon]):
+        types = {}
+        attack_names = {}
+        def intern(table, value):
+            value = sys.intern(normal_type(value))
+            return table.setdefault(value, len(table))
+
+        self.names = tuple(sys.intern(p.name) for p in roster)
+        self.type_ids = array('H', (intern(types, p.type) for p in roster))
+        self.weakness_ids = array('H', (intern(types, p.weakness) for p in roster))
+        self.resistance_ids = array('H', (intern(types, p.resistance) for p in roster))
+        self.health_points = array('I', (int(p.health_points) for p in roster))
+        self.stage = array('B', (int(p.stage) for p in roster))
+        # attacks of species i are attack_ids[attack_start[i]:attack_start[i + 1]]
+        self.attack_start = array('I', [0])
+        self.attack_ids = array('I')
+        self.attack_damage = array('I')
+        for p in roster:
+            for attack, damage in p.attacks.items():
+                self.attack_ids.append(attack_names.setdefault(sys.intern(attack), len(attack_names)))
+                self.attack_damage.append(int(damage))
+            self.attack_start.append(len(self.attack_ids))
+        self.types = tuple(types)
+        self.attack_names = tuple(attack_names)
+        self._index = {name: i for i, name in reversed(list(enumerate(self.names)))}
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name: str) -> int:
+        return self._index[name]
+
+    def attacks(self, species: int) -> list[tuple[int, int]]:
+        start, stop = self.attack_start[species], self.attack_start[species + 1]
+        return list(zip(self.attack_ids[start:stop], self.attack_damage[start:stop]))
+
+# fields RosterIndex.query() can match exactly, and the ones it can take a range of
+EXACT = ("type", "stage", "weakness", "resistance")
+RANGES = ("health_points", "max_damage")
+
+def _trigrams(name: str) -> set[str]:
+    padded = f"  {name.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class RosterIndex:
+    '''
+    In-memory secondary indexes over a roster: exact lookups by type, stage,
+    weakness and resistance, sorted ranges of hp and best attack damage, and
+    name search by prefix or by how alike the names are. Results come back
+    in roster order. Every index is updated a pokemon at a time with add,
+    update and remove, so it never has to be rebuilt.
+    '''
+
+    def __init__(self, roster=()):
+        self._next = 0
+        # name -> (position, the values it's indexed under, pokemon); the values are
+        # kept because an edit changes the pokemon before the index hears about it
+        self.entries: dict[str, tuple] = {}
+        self.exact: dict[str, dict] = {field: {} for field in EXACT}
+        self.ranges: dict[str, list] = {field: [] for field in RANGES}
+        self.names: list[tuple[str, str]] = []  # (lowercase name, name), sorted
+        # three-letter pieces of names -> names, only built once a search needs it
+        self.trigrams: dict[str, set[str]] | None = None
+        # a whole roster is appended unsorted and sorted once at the end
+        for pokemon in roster:
+            self._add(pokemon, None, list.append)
+        for items in self.ranges.values():
+            items.sort()
+        self.names.sort()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _values(self, pokemon) -> dict:
+        return {
+            "type": normal_type(pokemon.type),
+            "stage": pokemon.stage,
+            "weakness": normal_type(pokemon.weakness),
+            "resistance": normal_type(pokemon.resistance),
+            "health_points": pokemon.health_points,
+            "max_damage": max(pokemon.attacks.values(), default=0),
+        }
+
+    def add(self, pokemon, position=None):
+        self._add(pokemon, position, insort)
+
+    def _add(self, pokemon, position, place):
+        name = pokemon.name
+        if position is None:
+            position = self._next
+            self._next += 1
+        values = self._values(pokemon)
+        self.entries[name] = (position, values, pokemon)
+        for field in EXACT:
+            self.exact[field].setdefault(values[field], set()).add(name)
+        for field in RANGES:
+            place(self.ranges[field], (values[field], position, name))
+        place(self.names, (name.lower(), name))
+        if self.trigrams is not None:
+            self._add_trigrams(name)
+
+    def _add_trigrams(self, name):
+        for gram in _trigrams(name):
+            self.trigrams.setdefault(gram, set()).add(name)
+
+    def remove(self, name: str):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return None
+        position, values, _ = entry
+        for field in EXACT:
+            names = self.exact[field][values[field]]
+            names.discard(name)
+            if not names:
+                del self.exact[field][values[field]]
+        for field in RANGES:
+            items = self.ranges[field]
+            del items[bisect_left(items, (values[field], position, name))]
+        del self.names[bisect_left(self.names, (name.lower(), name))]
+        for gram in _trigrams(name) if self.trigrams is not None else ():
+            names = self.trigrams[gram]
+            names.discard(name)
+            if not names:
+                del self.trigrams[gram]
+        return position
+
+    def update(self, pokemon, old_name: str | None = None):
+        ''' re-indexes an added or edited pokemon, keeping its place in the roster '''
+        position = self.remove(old_name if old_name is not None else pokemon.name)
+        self.add(pokemon, position)
+
+    def _sorted(self, names) -> list:
+        return [entry[2] for entry in sorted(self.entries[name] for name in names)] if names else []
+
+    def query(self, prefix=None, min_hp=None, max_hp=None, min_damage=None, max_damage=None, **exact) -> list:
+        '''
+        Pokemon matching everything given: exact type, stage, weakness or
+        resistance, hp and best attack damage between the bounds (inclusive),
+        and names starting with prefix (case-insensitive).
+        '''
+        matches = None
+
+        def narrow(names):
+            nonlocal matches
+            matches = set(names) if matches is None else matches & set(names)
+
+        for field, value in exact.items():
+            if field not in EXACT:
+                raise ValueError(f"Can't look pokemon up by {field}.")
+            if field in ("type", "weakness", "resistance"):
+                value = normal_type(value)
+            narrow(self.exact[field].get(value, ()))
+        for field, low, high in (("health_points", min_hp, max_hp), ("max_damage", min_damage, max_damage)):
+            if low is None and high is None:
+                continue
+            items = self.ranges[field]
+            start = 0 if low is None else bisect_left(items, (low,))
+            end = len(items) if high is None else bisect_right(items, (high, float('inf')))
+            narrow(name for _, _, name in items[start:end])
+        if prefix:
+            prefix = prefix.lower()
+            start = bisect_left(self.names, (prefix,))
+            end = bisect_left(self.names, (prefix + "\U0010ffff",))
+            narrow(name for _, name in self.names[start:end])
+        if matches is None:
+            return self._sorted(self.entries)
+        return self._sorted(matches)
+
+    def search(self, text: str, limit=20) -> list:
+        '''
+        Pokemon whose names start with text, then those with names most like
+        it (sharing the most three-letter pieces, ranked by difflib), best first.
+        '''
+        found = self.query(prefix=text)[:limit]
+        if len(found) >= limit or not text.strip():
+            return found
+        if self.trigrams is None:
+            self.trigrams = {}
+            for name in self.entries:
+                self._add_trigrams(name)
+        seen = {p.name for p in found}
+        shared: dict[str, int] = {}
+        for gram in _trigrams(text):
+            for name in self.trigrams.get(gram, ()):
+                if name not in seen:
+                    shared[name] = shared.get(name, 0) + 1
+        # only the names sharing the most pieces are worth comparing properly
+        candidates = sorted(shared, key=lambda name: -shared[name])[:10 * limit]
+        text = text.lower()
+        ranked = sorted(
+            candidates,
+            key=lambda name: -difflib.SequenceMatcher(None, text, name.lower()).ratio(),
+        )
+        close = [name for name in ranked if difflib.SequenceMatcher(None, text, name.lower()).ratio() >= 0.5]
+        return found + [self.entries[name][2] for name in close[:limit - len(found)]]
+
+def parse_query(text: str) -> dict:
+    '''
+    RosterIndex.query() arguments from words like "type=fire stage=2 hp>=100 damage<50";
+    any other words are a name prefix
+    '''
+    fields = {"hp": ("min_hp", "max_hp"), "damage": ("min_damage", "max_damage")}
+    kwargs = {}
+    words = []
+    for word in text.split():
+        for symbol in (">=", "<=", "=", ">", "<"):
+            key, sep, value = word.partition(symbol)
+            if sep:
+                break
+        else:
+            words.append(word)
+            continue
+        key = key.lower()
+        if key in fields:
+            try:
+                number = int(value)
+            except ValueError:
+                raise ValueError(f"{key} is compared with a whole number, not {value!r}")
+            low, high = fields[key]
+            if symbol in (">=", "=", ">"):
+                kwargs[low] = number + (symbol == ">")
+            if symbol in ("<=", "=", "<"):
+                kwargs[high] = number - (symbol == "<")
+        elif key in EXACT and symbol == "=":
+            kwargs[key] = int(value) if key == "stage" and value.isdigit() else value
+        else:
+            raise ValueError(f"Can't search by {word!r}; use type, stage, weakness or resistance with =, or hp and damage with = < <= > >=.")
+    if words:
+        kwargs["prefix"] = " ".join(words)
+    return kwargs
+
+REQUIRED_FIELDS = frozenset(FIELDS) - {"weakness", "resistance"}
+
+@dataclass
+class RecordError:
+    index: int
+    name: str
+    reason: str
+
+class BatchError(ValueError):
+    ''' a batch change that wasn't applied, with every record that was wrong with it '''
+
+    def __init__(self, errors: List[RecordError]):
+        self.errors = errors
+        super().__init__("; ".join(f"entry {e.index + 1} ({e.name or 'no name'}): {e.reason}" for e in errors))
+
+def _as_int(record, key, minimum):
+    try:
+        value = int(record[key])
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a whole number, not {record[key]!r}")
+    if value < minimum:
+        raise ValueError(f"{key} must be at least {minimum}")
+    return value
+
+def normalize_record(record) -> dict:
+    ''' checks a roster entry and converts its fields to their proper types, raising ValueError if it can't '''
+    if not isinstance(record, dict):
+        raise ValueError("entry is not an object")
+    if not REQUIRED_FIELDS <= record.keys():
+        missing = [key for key in FIELDS if key in REQUIRED_FIELDS and key not in record]
+        raise ValueError(f"missing {', '.join(missing)}")
+    name = str(record["name"]).strip()
+    if not name:
+        raise ValueError("name is empty")
+    if not isinstance(record["attacks"], dict):
+        raise ValueError("attacks must map attack names to damage")
+    attacks = {}
+    for attack, damage in record["attacks"].items():
+        if attack == "":
+            continue
+        attacks[attack] = _as_int(record["attacks"], attack, 0)
+    if not attacks:
+        raise ValueError("has no attacks")
+    return {
+        "name": name,
+        "type": str(record["type"]).strip(),
+        "health_points": _as_int(record, "health_points", 1),
+        "stage": _as_int(record, "stage", 0),
+        "attacks": attacks,
+        "weakness": str(record.get("weakness") or ""),
+        "resistance": str(record.get("resistance") or ""),
+    }
+
+def iter_json_list(f, chunk_size=1 << 16):
+    ''' yields the items of a JSON list one at a time, reading the file a chunk at a time '''
+    decoder = json.JSONDecoder()
+    buffer, pos = "", 0
+
+    def fill():
+        nonlocal buffer, pos
+        chunk = f.read(chunk_size)
+        buffer, pos = buffer[pos:] + chunk, 0
+        return bool(chunk)
+
+    def skip(chars):
+        nonlocal pos
+        while pos < len(buffer) and buffer[pos] in chars:
+            pos += 1
+
+    skip(" \t\r\n")
+    while pos == len(buffer):
+        if not fill():
+            return
+        skip(" \t\r\n")
+    if buffer[pos] != "[":
+        raise ValueError("expected a JSON list")
+    pos += 1
+    while True:
+        skip(" \t\r\n,")
+        if pos == len(buffer):
+            if not fill():
+                raise ValueError("unterminated JSON list")
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # most likely the item runs past the end of the buffer
+            if not fill():
+                raise
+            continue
+        pos = end
+        yield item
+
+def iter_pokemon(records, errors: List[RecordError] | None = None):
+    '''
+    yields a Pokemon for every valid record, collecting why the others were
+    skipped in errors. Only the first pokemon of a name is kept, since
+    everything else looks pokemon up by name.
+    '''
+    seen = set()
+    for index, record in enumerate(records):
+        try:
+            normalized = normalize_record(record)
+            if normalized["name"] in seen:
+                raise ValueError("appears more than once")
+            seen.add(normalized["name"])
+            yield Pokemon(**normalized)
+        except ValueError as e:
+            if errors is not None:
+                name = record.get("name", "") if isinstance(record, dict) else ""
+                errors.append(RecordError(index, str(name), str(e)))
 
 class PokemonManager:
-    def __init__(self, filename: str = "pokemon.json"):
+    def __init__(self, filename: str = "pokemon.json", snapshot: bool = True):
         self.filename = filename
-        self.pokemon: List[Pokemon] = []
-        self.load_pokemon()
+        # the roster is only read when it's first needed
+        self._pokemon: List[Pokemon] | None = None
+        self._by_name: dict[str, Pokemon] = {}
+        # built from the roster when first used, then kept up to date a pokemon at a time
+        self._damage: DamageMatrix | None = None
+        self._index: RosterIndex | None = None
+        self.load_errors: List[RecordError] = []
+        # .db files are kept in SQLite and saved a pokemon at a time, anything else as a JSON list
+        self.store = SqliteStore(filename) if SqliteStore.handles(filename) else None
+        # JSON rosters are read through a binary snapshot that's rebuilt whenever the JSON changes
+        self.use_snapshot = snapshot and self.store is None
 
-    def load_pokemon(self):
-        if os.path.exists(self.filename):
+    def _loaded(self):
+        if self._pokemon is None:
+            self.load_pokemon()
+
+    @property
+    def pokemon(self) -> List[Pokemon]:
+        self._loaded()
+        return self._pokemon
+
+    @pokemon.setter
+    def pokemon(self, pokemon: List[Pokemon]):
+        self._pokemon = pokemon
+        self._by_name = {p.name: p for p in pokemon}
+        self._damage = None
+        self._index = None
+
+    @property
+    def by_name(self) -> dict[str, Pokemon]:
+        self._loaded()
+        return self._by_name
+
+    @property
+    def damage(self) -> DamageMatrix:
+        self._loaded()
+        if self._damage is None:
+            self._damage = DamageMatrix(self._pokemon)
+        return self._damage
+
+    @property
+    def index(self) -> RosterIndex:
+        self._loaded()
+        if self._index is None:
+            self._index = RosterIndex(self._pokemon)
+        return self._index
+
+    def _track(self, pokemon: Pokemon, old_name: str | None = None):
+        ''' brings the damage table and the index up to date with an added or edited pokemon '''
+        if self._damage is not None:
+            self._damage.update(pokemon, old_name)
+        if self._index is not None:
+            self._index.update(pokemon, old_name)
+
+    def _untrack(self, pokemon: Pokemon):
+        if self._damage is not None:
+            self._damage.remove(pokemon.name)
+        if self._index is not None:
+            self._index.remove(pokemon.name)
+
+    def _records(self):
+        if self.store:
+            yield from self.store.load()
+        elif os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                yield from iter_json_list(f)
+
+    def snapshot(self) -> Snapshot | None:
+        if not self.use_snapshot or not os.path.exists(self.filename):
+            return None
+
+        def compile():
+            errors = []
             with open(self.filename, 'r') as f:
-                data = json.load(f)
-                for pokemon in data:
-                    if all("" == key for key in pokemon['attacks']):
-                        continue
-                    self.pokemon.append(Pokemon(**pokemon)) 
+                records = [pokemon.to_record() for pokemon in iter_pokemon(iter_json_list(f), errors)]
+            return records, [asdict(error) for error in errors]
+
+        try:
+            return open_snapshot(self.filename, compile)
+        except (OSError, struct.error):
+            # e.g. a read-only directory or values too big for the snapshot, read the JSON instead
+            return None
+
+    def load_pokemon(self):
+        with metrics.timer("manager_load_seconds"):
+            self._load()
+
+    def _load(self):
+        self.load_errors = []
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            self.load_errors = [RecordError(**error) for error in snapshot.errors]
+            self.pokemon = [Pokemon(**record) for record in snapshot]
+            return
+        self.pokemon = list(iter_pokemon(self._records(), self.load_errors))
+
+    def page(self, number: int, size: int = 20) -> List[Pokemon]:
+        ''' the pokemon on a 1-based page, without reading past it if the roster isn't loaded yet '''
+        start = (number - 1) * size
+        if self._pokemon is not None:
+            return self._pokemon[start:start + size]
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            return [Pokemon(**snapshot.record(i)) for i in range(start, min(start + size, len(snapshot)))]
+        return list(itertools.islice(iter_pokemon(self._records()), start, start + size))
+
+    def find(self, name: str) -> Pokemon | None:
+        return self.by_name.get(name)
+
+    def search(self, text: str, limit=200) -> List[Pokemon]:
+        '''
+        Pokemon matching text, which is a name or part of one (matched by
+        prefix, then by likeness), or filters like "type=fire hp>100"
+        (see parse_query), optionally followed by a name prefix.
+        '''
+        query = parse_query(text)
+        if set(query) == {"prefix"}:
+            return self.index.search(query["prefix"], limit)
+        return self.index.query(**query)
+
+    def species_table(self) -> SpeciesTable:
+        return SpeciesTable(self.pokemon)
 
     def save_pokemon(self):
-        with open(self.filename, 'w') as f:
-            keepers = [
-                "name",
-                "type",
-                "health_points",
-                "stage",
-                "attacks",
-                "weakness",
-                "resistance"
-            ]
-            dump_list = [
-                {key: val for key, val in vars(pokemon).items() if key in keepers}
-                for pokemon in self.pokemon
-            ]
-            json.dump(dump_list, f, indent=2)
+        with metrics.timer("manager_save_seconds", scope="all"):
+            dump_list = [pokemon.to_record() for pokemon in self.pokemon]
+            if self.store:
+                self.store.replace_all(dump_list)
+            else:
+                with open(self.filename, 'w') as f:
+                    json.dump(dump_list, f, indent=2)
+        self._update_results(records=dump_list)
 
-    def add_pokemon(self):
+    def _update_results(self, changed: dict[str, str | None] | None = None, records=None):
+        '''
+        Drops the cached simulation results next to the roster (see results.py)
+        that used pokemon as they were before a save: those named in changed,
+        or with records, every one that used a pokemon not among them as is.
+        '''
+        path = results_path(self.filename)
+        if not os.path.exists(path):
+            return
+        cache = ResultCache(path)
         try:
-            name = input("Enter pokemon name: ").strip()
-            pokemon_type = input("Enter pokemon type: ").strip()
-            health_points = int(input("Enter health_points: "))
-            stage = int(input("Enter stage: "))
-            attacking = True
-            attacks = []
-            while attacking:
-                attack_name = input("Enter attack name: (hit Enter if no more attacks): ")
-                if attack_name == '': 
-                    attacking = False
-                    break
-                attack_damage = int(input(f"Enter '{attack_name}' damage: "))
-                attacks.append((attack_name, attack_damage))
-
-            weakness = input("Enter weakness: ")
-            resistance = input("Enter resistance: ")
-            
-            # if height <= 0 or weight <= 0 or age < 0:
-            #     print("Height, weight, and age must be positive values.")
-            #     return
-            
-            pokemon = Pokemon(
-                name, 
-                pokemon_type, 
-                health_points, 
-                stage, 
-                {attack_name: attack_damage 
-                    for attack_name, attack_damage in attacks},
-                weakness,
-                resistance
-            )
-
-                
-            self.pokemon.append(pokemon)
+            if records is not None:
+                cache.retain({record["name"]: record_hash(record) for record in records})
+            else:
+                cache.update(changed)
+        finally:
+            cache.close()
+
+    def save_one(self, pokemon: Pokemon, old_name: str | None = None):
+        ''' persists a single added or edited pokemon '''
+        if old_name is not None and old_name != pokemon.name:
+            self.by_name.pop(old_name, None)
+        self.by_name[pokemon.name] = pokemon
+        if self.store:
+            record = pokemon.to_record()
+            with metrics.timer("manager_save_seconds", scope="one"):
+                self.store.put(record, old_name)
+            changed = {pokemon.name: record_hash(record)}
+            if old_name is not None and old_name != pokemon.name:
+                changed[old_name] = None
+            self._update_results(changed)
+        else:
             self.save_pokemon()
-            print(f"Added {name} successfully!")
-        except ValueError:
-            print("Invalid input. Height and weight must be numbers, age must be an integer.")
 
-    def view_pokemon(self, namesOnly = False):
-        if not self.pokemon:
-            print("No pokemon in the database.")
+    def remove_one(self, pokemon: Pokemon):
+        if self.by_name.get(pokemon.name) is pokemon:
+            del self.by_name[pokemon.name]
+        if self.store:
+            with metrics.timer("manager_save_seconds", scope="one"):
+                self.store.delete(pokemon.name)
+            self._update_results({pokemon.name: None})
+        else:
+            self.save_pokemon()
+
+    def _apply_batch(self, puts: List[tuple[Pokemon, str | None]], removed: List[Pokemon]):
+        ''' updates the lookups and writes a whole batch of changes at once '''
+        for pokemon in removed:
+            self._untrack(pokemon)
+            if self.by_name.get(pokemon.name) is pokemon:
+                del self.by_name[pokemon.name]
+        for pokemon, old_name in puts:
+            if old_name is not None and old_name != pokemon.name:
+                self.by_name.pop(old_name, None)
+            self.by_name[pokemon.name] = pokemon
+            self._track(pokemon, old_name)
+        if self.store:
+            records = [(p.to_record(), old_name) for p, old_name in puts]
+            with metrics.timer("manager_save_seconds", scope="batch"):
+                self.store.apply(records, [p.name for p in removed])
+            changed = {p.name: None for p in removed}
+            for record, old_name in records:
+                if old_name is not None and old_name != record["name"]:
+                    changed[old_name] = None
+            for record, _ in records:
+                changed[record["name"]] = record_hash(record)
+            self._update_results(changed)
+        else:
+            self.save_pokemon()
+
+    def import_records(self, records, replace=False) -> tuple[int, int]:
+        '''
+        Adds every record, updating the pokemon of the same name where there
+        is one, or with replace set swaps the whole roster for the records.
+        Nothing changes unless every record is valid; otherwise a BatchError
+        lists the ones that aren't. Returns how many were added and updated.
+        '''
+        errors = []
+        valid = {}
+        for index, record in enumerate(records):
+            try:
+                normalized = normalize_record(record)
+            except ValueError as e:
+                name = record.get("name", "") if isinstance(record, dict) else ""
+                errors.append(RecordError(index, str(name), str(e)))
+                continue
+            if normalized["name"] in valid:
+                errors.append(RecordError(index, normalized["name"], "appears more than once"))
+            valid[normalized["name"]] = normalized
+        if errors:
+            raise BatchError(errors)
+
+        if replace:
+            added = sum(1 for name in valid if name not in self.by_name)
+            self.pokemon = [Pokemon(**record) for record in valid.values()]
+            if self.store:
+                records = [p.to_record() for p in self.pokemon]
+                with metrics.timer("manager_save_seconds", scope="batch"):
+                    self.store.replace_all(records)
+                self._update_results(records=records)
+            else:
+                self.save_pokemon()
+            return added, len(valid) - added
+
+        puts = []
+        added = 0
+        for name, record in valid.items():
+            pokemon = self.by_name.get(name)
+            if pokemon is None:
+                pokemon = Pokemon(**record)
+                self.pokemon.append(pokemon)
+                added += 1
+                puts.append((pokemon, None))
+            else:
+                for key in FIELDS:
+                    setattr(pokemon, key, record[key])
+                puts.append((pokemon, name))
+        self._apply_batch(puts, [])
+        return added, len(valid) - added
+
+    def patch(self, patches: dict[str, dict]) -> int:
+        '''
+        Edits many pokemon at once, each given as name -> {field: new value};
+        a new "name" renames it and new "attacks" replace the old ones. All
+        or nothing, like import_records. Returns how many were changed.
+        '''
+        errors = []
+        changes = []
+        for index, (name, fields) in enumerate(patches.items()):
+            pokemon = self.by_name.get(name)
+            try:
+                if pokemon is None:
+                    raise ValueError("no pokemon by that name")
+                unknown = set(fields) - set(FIELDS)
+                if unknown:
+                    raise ValueError(f"unknown fields {', '.join(sorted(unknown))}")
+                record = normalize_record({**pokemon.to_record(), **fields})
+                if record["name"] != name and record["name"] in self.by_name:
+                    raise ValueError(f"can't rename to {record['name']}, which is already in the roster")
+            except ValueError as e:
+                errors.append(RecordError(index, name, str(e)))
+                continue
+            changes.append((pokemon, record))
+        new_names = [record["name"] for _, record in changes]
+        if len(set(new_names)) != len(new_names):
+            errors.append(RecordError(len(patches), "", "two pokemon would get the same name"))
+        if errors:
+            raise BatchError(errors)
+
+        puts = []
+        for pokemon, record in changes:
+            old_name = pokemon.name
+            for key in FIELDS:
+                setattr(pokemon, key, record[key])
+            puts.append((pokemon, old_name))
+        self._apply_batch(puts, [])
+        return len(changes)
+
+    def delete_where(self, predicate) -> List[Pokemon]:
+        ''' removes every pokemon predicate(pokemon) is true for, with one write, and returns them '''
+        kept, removed = [], []
+        for pokemon in self.pokemon:
+            (removed if predicate(pokemon) else kept).append(pokemon)
+        if removed:
+            self._pokemon[:] = kept
+            self._apply_batch([], removed)
+        return removed
+
+    def add_pokemon(self):
+        name = input("Enter pokemon name: ").strip()
+        if name in self.by_name:
+            print(f"There's already a pokemon called {name}.")
+            return
+        pokemon_type = input("Enter pokemon type: ").strip()
+        health_points = input("Enter health_points: ")
+        stage = input("Enter stage: ")
+        attacks = {}
+        while True:
+            attack_name = input("Enter attack name: (hit Enter if no more attacks): ")
+            if attack_name == '':
+                break
+            attacks[attack_name] = input(f"Enter '{attack_name}' damage: ")
+
+        weakness = input("Enter weakness: ")
+        resistance = input("Enter resistance: ")
+
+        # the same checks as entries read from a file
+        try:
+            record = normalize_record({
+                "name": name,
+                "type": pokemon_type,
+                "health_points": health_points,
+                "stage": stage,
+                "attacks": attacks,
+                "weakness": weakness,
+                "resistance": resistance,
+            })
+        except ValueError as e:
+            print(f"Invalid input: {e}.")
             return
-        for i, pokemon in enumerate(self.pokemon, 1):
+        pokemon = Pokemon(**record)
+        self.pokemon.append(pokemon)
+        self._track(pokemon)
+        self.save_one(pokemon)
+        print(f"Added {name} successfully!")
+
+    def _show(self, shown: List[Pokemon], first: int, namesOnly=False):
+        for i, pokemon in enumerate(shown, first):
             if namesOnly:
-                print(f"\nPokemon {i}:")
+                print(f"  {i}. {pokemon.name} ({pokemon.type}, {pokemon.health_points} HP)")
 
             else:
                 print(f"\nPokemon {i}:")
@@ -115,85 +814,153 @@ class PokemonManager:
                 print(f"  Weakness: {pokemon.weakness}")
                 print(f"  Resistance: {pokemon.resistance}")
 
+    def view_pokemon(self, namesOnly = False, page = None, page_size = 20):
+        shown = self.pokemon if page is None else self.page(page, page_size)
+        if not shown:
+            print("No more pokemon." if page and page > 1 else "No pokemon in the database.")
+            return 0
+        first = 1 if page is None else (page - 1) * page_size + 1
+        self._show(shown, first, namesOnly)
+        return len(shown)
+
+    def search_pokemon(self, verb=None, page_size = 20) -> Pokemon | None:
+        '''
+        Asks for a name or filters and pages through what matches. With a
+        verb ("edit", "delete") it asks which of them to pick and returns it.
+        '''
+        text = input("Enter a name, part of one, or filters like type=fire stage=2 hp>100 damage>=50: ").strip()
+        if not text:
+            return None
+        exact = self.find(text)
+        if exact is not None and verb:
+            return exact
+        try:
+            results = self.search(text)
+        except ValueError as e:
+            print(e)
+            return None
+        if not results:
+            print("No pokemon match that.")
+            return None
+        print(f"{len(results)} match{'es' if len(results) != 1 else ''}:")
+        start = 0
+        while True:
+            self._show(results[start:start + page_size], start + 1, namesOnly=verb is not None)
+            start += page_size
+            more = start < len(results)
+            if verb:
+                prompt = f"\nEnter the pokemon number to {verb}" + (", Enter for more" if more else "") + ", q to stop: "
+            elif more:
+                prompt = "\nEnter for the next page, q to stop: "
+            else:
+                return None
+            choice = input(prompt).strip().lower()
+            if choice == 'q' or (not choice and not more):
+                return None
+            if choice:
+                if verb and choice.isdigit() and 1 <= int(choice) <= len(results):
+                    return results[int(choice) - 1]
+                print("Invalid pokemon number.")
+                return None
+
     def edit_pokemon(self):
-        self.view_pokemon()
         if not self.pokemon:
+            print("No pokemon in the database.")
+            return
+        pokemon = self.search_pokemon("edit")
+        if pokemon is None:
+            return
+        old_name = pokemon.name
+        print(f"Editing {pokemon.name}. Leave blank to keep current value.")
+
+        name = input(f"New name ({pokemon.name}): ").strip()
+        if name and name != pokemon.name and name in self.by_name:
+            print(f"There's already a pokemon called {name}.")
             return
+        pokemon_type = input(f"New Type ({pokemon.type}): ").strip()
+        health_points = input(f"New health_points ({pokemon.health_points}): ").strip()
+        stage = input(f"New stage ({pokemon.stage}): ").strip()
+        print(f"New Attacks: ")
+        updated_attacks = {}
+        for attack in pokemon.attacks:
+            attack_name = input(f"New attack name: ({attack}): ").strip()
+            attack_damage = input(f"New attack damage: ({attack}: {pokemon.attacks[attack]}): ")
+            if attack_name and attack_damage:
+                updated_attacks[attack_name] = attack_damage
+        weakness = input(f"New Weakness ({pokemon.weakness}): ").strip()
+        resistance = input(f"New Resistance ({pokemon.resistance}): ").strip()
+
+        changes = {
+            "name": name,
+            "type": pokemon_type,
+            "health_points": health_points,
+            "stage": stage,
+            "attacks": updated_attacks,
+            "weakness": weakness,
+            "resistance": resistance,
+        }
+        # checked as a whole before anything changes, so a typo can't leave a half-edited pokemon
         try:
-            index = int(input("Enter the pokemon number to edit: ")) - 1
-            if 0 <= index < len(self.pokemon):
-                pokemon = self.pokemon[index]
-                print(f"Editing {pokemon.name}. Leave blank to keep current value.")
-                
-                name = input(f"New name ({pokemon.name}): ").strip()
-                pokemon_type = input(f"New Type ({pokemon.type}): ").strip()
-                health_points = input(f"New health_points ({pokemon.health_points}): ").strip()
-                stage = input(f"New stage ({pokemon.stage}): ").strip()
-                print(f"New Attacks: ")
-                updated_attacks = {}
-                for attack in pokemon.attacks:
-                    attack_name = input(f"New attack name: ({attack}): ").strip()
-                    attack_damage = input(f"New attack damage: ({attack}: {pokemon.attacks[attack]}): ")
-                    if attack_name and attack_damage:
-                        updated_attacks[attack_name] = attack_damage
-                weakness = input(f"New Weakness ({pokemon.weakness}): ").strip()
-                resistance = input(f"New Resistance ({pokemon.resistance}): ").strip()
-
-                pokemon.name = name if name else pokemon.name
-                pokemon.type = pokemon_type if pokemon_type else pokemon.type
-                pokemon.health_points = int(health_points) if health_points else pokemon.health_points
-                pokemon.stage = int(stage) if stage else pokemon.stage
-                pokemon.attacks = updated_attacks if len(updated_attacks) > 0 else pokemon.attacks
-                pokemon.weakness = weakness if weakness else pokemon.weakness
-                pokemon.resistance = resistance if resistance else pokemon.resistance
+            record = normalize_record({**pokemon.to_record(), **{key: value for key, value in changes.items() if value}})
+        except ValueError as e:
+            print(f"Invalid input: {e}.")
+            return
+        for key in FIELDS:
+            setattr(pokemon, key, record[key])
 
-                self.save_pokemon()
-                print(f"Updated {pokemon.name} successfully!")
-            else:
-                print("Invalid pokemon number.")
-        except ValueError:
-            print("Invalid input. Height and weight must be numbers, age must be an integer.")
+        self._track(pokemon, old_name)
+        self.save_one(pokemon, old_name)
+        print(f"Updated {pokemon.name} successfully!")
 
     def delete_pokemon(self):
-        self.view_pokemon()
         if not self.pokemon:
+            print("No pokemon in the database.")
             return
-        try:
-            index = int(input("Enter the pokemon number to delete: ")) - 1
-            if 0 <= index < len(self.pokemon):
-                pokemon = self.pokemon.pop(index)
-                self.save_pokemon()
-                print(f"Deleted {pokemon.name} successfully!")
-            else:
-                print("Invalid pokemon number.")
-        except ValueError:
-            print("Invalid input. Please enter a number.")
+        pokemon = self.search_pokemon("delete")
+        if pokemon is None:
+            return
+        self.pokemon.remove(pokemon)
+        self._untrack(pokemon)
+        self.remove_one(pokemon)
+        print(f"Deleted {pokemon.name} successfully!")
 
     def run(self):
+        self._loaded()
+        for error in self.load_errors:
+            print(f"Skipped entry {error.index + 1} ({error.name or 'no name'}) in {self.filename}: {error.reason}")
         while True:
             print("\nPokemon Manager")
             print("1. Add pokemon")
             print("2. View pokemon")
             print("3. Edit pokemon")
             print("4. Delete pokemon")
-            print("5. Exit")
+            print("5. Search pokemon")
+            print("6. Exit")
             
-            choice = input("Enter your choice (1-5): ").strip()
+            choice = input("Enter your choice (1-6): ").strip()
             
             if choice == '1':
                 self.add_pokemon()
             elif choice == '2':
-                self.view_pokemon()
+                page = 1
+                while self.view_pokemon(page=page) == 20:
+                    if input("\nEnter for the next page, q to stop: ").strip().lower() == 'q':
+                        break
+                    page += 1
             elif choice == '3':
                 self.edit_pokemon()
             elif choice == '4':
                 self.delete_pokemon()
             elif choice == '5':
+                self.search_pokemon()
+            elif choice == '6':
                 print("Goodbye!")
                 break
             else:
-                print("Invalid choice. Please enter a number between 1 and 5.")
+                print("Invalid choice. Please enter a number between 1 and 6.")
 
 if __name__ == "__main__":
-    manager = PokemonManager()
-    manager.run()
+    parser = argparse.ArgumentParser(description="Add, view, edit and delete pokemon.")
+    parser.add_argument('--file', default="pokemon.json", help="roster to manage (.db for SQLite)")
+    args = parser.parse_args()
+    PokemonManager(args.file).run()
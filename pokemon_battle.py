@@ -1,28 +1,26 @@
+import argparse
 import random
+from contextlib import nullcontext
 
+from ai import MAX_DIFFICULTY, SEARCH_DEPTHS, computer_policy
+import metrics
+from draft import DraftAdvisor
+from engine import COMPUTER, PLAYER, Attack, BattleState, Forfeit, Player, Swap, computer_action
 from pokemon import Pokemon, PokemonManager
-
-class Player:
-    def __init__(self, name, pokemon):
-        self.name = name
-        self.pokemon = pokemon
-        self.active_pokemon = pokemon[0]
-
-    def has_alive_pokemon(self):
-        return any(pokemon.is_alive() for pokemon in self.pokemon)
-
-    def swap_pokemon(self, index):
-        if 0 <= index < len(self.pokemon) and self.pokemon[index].is_alive():
-            self.active_pokemon = self.pokemon[index]
-            return True
-        return False
+from replay import BattleLog
 
 def display_status(player, computer):
     print("\n****************************")
     print("******** New Round! ********")
     print("****************************\n")
-    print(f"\n{player.name}'s {player.active_pokemon.name}: {player.active_pokemon.hp}/{player.active_pokemon.max_hp} HP")
-    print(f"Computer's {computer.active_pokemon.name}: {computer.active_pokemon.hp}/{computer.active_pokemon.max_hp} HP\n")
+    print(f"\n{player.name}'s {player.active_pokemon.name}: {player.active_hp}/{player.active_pokemon.health_points} HP")
+    print(f"Computer's {computer.active_pokemon.name}: {computer.active_hp}/{computer.active_pokemon.health_points} HP\n")
+
+def show_team(player):
+    print("Available Pokemon:")
+    for i, pokemon in enumerate(player.pokemon):
+        status = "Alive" if player.is_alive(i) else "Fainted"
+        print(f"{i+1}. {pokemon.name} ({player.hp[i]}/{pokemon.health_points} HP, {status})")
 
 def player_turn(player, computer):
     print(f"{player.name}'s turn!")
@@ -43,64 +41,87 @@ def player_turn(player, computer):
                 else:
                     print(f"         {i}. {attack} ({player.active_pokemon.attacks[attack]} dmg)")
 
-                choice_map[i] = attack
+                choice_map[str(i)] = attack
                 i += 1
 
             attack_choice = input(f"Choose attack (1-{i-1}): ").strip()
 
-            if attack_choice in ["1", "2"]:
-                damage = computer.active_pokemon.take_damage(player.active_pokemon.attacks[choice_map[int(attack_choice)]])
-                print(f"{player.active_pokemon.name} used {choice_map[int(attack_choice)]} and dealt {damage} damage!")
-                input("\t Enter to continue...\n")
-                return True
+            if attack_choice in choice_map:
+                return Attack(choice_map[attack_choice])
             else:
                 print("Invalid attack choice. Try again.")
         elif choice == "2":
-            print("Available Pokemon:")
-            for i, pokemon in enumerate(player.pokemon):
-                status = "Alive" if pokemon.is_alive() else "Fainted"
-                print(f"{i+1}. {pokemon.name} ({pokemon.hp}/{pokemon.max_hp} HP, {status})")
+            show_team(player)
             swap_choice = input(f"Choose Pokemon to swap to (1-{len(player.pokemon)}, 0 to cancel): ").strip()
             if swap_choice == "0":
                 continue
             try:
                 index = int(swap_choice) - 1
-                if player.swap_pokemon(index):
-                    print(f"{player.name} swapped to {player.active_pokemon.name}!")
-                    return True
+                if index != player.active_index and 0 <= index < len(player.pokemon) and player.is_alive(index):
+                    return Swap(index)
                 else:
                     print("Invalid choice or Pokemon is fainted. Try again.")
             except ValueError:
                 print("Invalid input. Try again.")
         elif choice == "3":
-            print(f"{player.name} forfeited the battle!")
-            return False
+            return Forfeit()
         else:
             print("Invalid choice. Try again.")
 
-def computer_turn(computer, player, difficulty=2):
+def player_replacement(player):
+    show_team(player)
+    while True:
+        swap_choice = input(f"Choose Pokemon to swap to (1-{len(player.pokemon)}): ").strip()
+        try:
+            index = int(swap_choice) - 1
+            if 0 <= index < len(player.pokemon) and player.is_alive(index):
+                return Swap(index)
+            else:
+                print("Invalid choice or Pokemon is fainted. Try again.")
+        except ValueError:
+            print("Invalid input. Try again.")
+
+def computer_turn(state, policy):
     print(f"Computer's turn!")
-    # Computer prioritizes attack if active pokemon is strong, else swaps or attacks randomly
-    available_pokemon = [i for i, pokemon in enumerate(computer.pokemon) if pokemon.is_alive() and pokemon != computer.active_pokemon]
-    if random.random() < 0.5 + 0.1 * difficulty or not available_pokemon:
-        attack_choice = random.choice([i for i in range(len(computer.active_pokemon.attacks.keys()))])
-        akey = list(computer.active_pokemon.attacks.keys())[attack_choice]
-        damage = player.active_pokemon.take_damage(computer.active_pokemon.attacks[akey])
-        print(f"{computer.active_pokemon.name} used {akey} and dealt {damage} damage!")
-        input("\t Enter to continue...\n")
+    return policy(state)
 
-    else:  # Swap to a random alive pokemon
-        swap_index = random.choice(available_pokemon)
-        computer.swap_pokemon(swap_index)
-        print(f"Computer swapped to {computer.active_pokemon.name}!")
-        input("\t Enter to continue...\n")
-    return True
+def show_events(state, events):
+    for event in events:
+        side = state.sides[event.side]
+        match event.kind:
+            case 'attack':
+                print(f"{event.pokemon} used {event.attack} and dealt {event.damage} damage!")
+                input("\t Enter to continue...\n")
+            case 'swap':
+                print(f"{side.name} swapped to {event.pokemon}!")
+                if event.side == COMPUTER:
+                    input("\t Enter to continue...\n")
+            case 'sent_out':
+                print(f"{side.name} sent out {event.pokemon}!")
+            case 'fainted':
+                print(f"{side.name}'s {event.pokemon} fainted!")
+                print(ASCII_ART['fainted'])
+                input("\t Enter to continue...\n")
+            case 'forfeit':
+                print(f"{side.name} forfeited the battle!")
+            case 'win':
+                if event.side == PLAYER:
+                    print("Player wins!\n")
+                    print(ASCII_ART['player_wins'])
+                else:
+                    print("Computer wins!\n")
+                    print(ASCII_ART['computer_wins'])
 
-def battle(settings = {}):
-    # Load Pokemon
-    manager = PokemonManager()
+def battle(settings = {}, manager = None, record = None):
+    # Load Pokemon, unless main() already has
+    manager = manager or PokemonManager()
     if settings['pick_limit']:
         pick_limit = settings['pick_limit']
+    difficulty = settings['difficulty'] if settings['difficulty'] else 2
+    # the computer's choices all come from one seeded generator, so a battle log can say how to redo them
+    seed = settings.get('seed', random.randrange(2**32))
+    rng = random.Random(seed)
+    policy = computer_policy(difficulty, rng, deadline=settings.get('deadline', 0.05))
 
     
     # player and computer take turns picking pokemon from common list
@@ -108,102 +129,100 @@ def battle(settings = {}):
     print("Each Pokemon has two attacks and health points. Take turns to attack, swap, or forfeit.")
     print("First, take turns selecting your Pokemon. Player goes first!")
     input("\t Enter to continue...\n")
-    unselected = {p.name: p for p in manager.pokemon}
-    players_pokemon = []
-    computer_pokemon = []
-    choice_map = {}
-    while len(players_pokemon) < pick_limit:
+    # picks are roster positions, the advisor scores them by expected win rate
+    roster = manager.pokemon
+    advisor = DraftAdvisor(roster, manager.damage)
+    unselected = list(range(len(roster)))
+    positions = {p.name: i for i, p in enumerate(roster)}
+    players_picks = []
+    computer_picks = []
+    while len(players_picks) < pick_limit:
         # print out the remaining pokemon names to choose from
-        print(f"Select your next Pokemon. You have {pick_limit - len(players_pokemon)} of {pick_limit} selections left:")
-        choice_map = {}
-        c = 1
-        for p in unselected:
-            print(f"  {c}. {p}\n")
-            choice_map[str(c)] = p
-            c += 1
-
-        player_choice = input(f"Pick a Pokemon (1-{c-1}): ")
-        players_pokemon.append(unselected[choice_map[player_choice]])
-        player_pick = choice_map[player_choice]
-        del unselected[choice_map[player_choice]]
-        print(f"You picked {player_pick}!")
+        print(f"Select your next Pokemon. You have {pick_limit - len(players_picks)} of {pick_limit} selections left:")
+        suggestion = advisor.pick(unselected, players_picks, computer_picks, pick_limit)
+        player_pick = choose_pick(manager, unselected, suggestion, positions)
+        players_picks.append(player_pick)
+        print(f"You picked {roster[player_pick].name}!")
 
-        # computer selects a pokemon
-        choice_map = {
-            i: p for i,p in enumerate(unselected.keys())
-        }
-        if len(unselected) - 1 > 0:
-            computer_choice = random.randint(0,len(unselected)-1)
+        # computer selects a pokemon, the searching difficulties with the advisor
+        if difficulty in SEARCH_DEPTHS:
+            computer_pick = advisor.pick(unselected, computer_picks, players_picks, pick_limit)
+            unselected.remove(computer_pick)
         else:
-            computer_choice = 0
-        computer_pokemon.append(unselected[choice_map[computer_choice]])
-        computer_pick = choice_map[computer_choice]
-        del unselected[choice_map[computer_choice]]
-        print(f"Computer picked {computer_pick}!")
+            computer_pick = unselected.pop(rng.randint(0, len(unselected) - 1))
+        computer_picks.append(computer_pick)
+        print(f"Computer picked {roster[computer_pick].name}!")
         input("\t Enter to continue...\n")
-        
+
+    players_pokemon = [roster[i] for i in players_picks]
+    computer_pokemon = [roster[i] for i in computer_picks]
     player = Player("Player", players_pokemon)
     computer = Player("Computer", computer_pokemon)
+    state = BattleState(player, computer, damage=manager.damage)
+    log_file = open(record, 'a') if record else None
+    if log_file:
+        BattleLog(log_file).start(state, seed, difficulty)
     
-    
-    while player.has_alive_pokemon() and computer.has_alive_pokemon():
-        display_status(player, computer)
-        
-        # Player's turn
-        if not player_turn(player, computer):
-            print("Computer wins!\n")
-            print(ASCII_ART['computer_wins'])
-            break
-            
-        if not computer.active_pokemon.is_alive():
-            print(f"Computer's {computer.active_pokemon.name} fainted!")
-            print(ASCII_ART['fainted'])
-            input("\t Enter to continue...\n")
-            alive_pokemon = [i for i, pokemon in enumerate(computer.pokemon) if pokemon.is_alive()]
-            if alive_pokemon:
-                computer.swap_pokemon(alive_pokemon[0])
-                print(f"Computer sent out {computer.active_pokemon.name}!")
-            else:
-                print("Player wins!\n")
-                print(ASCII_ART['player_wins'])
-                break
-                
-        if not computer.has_alive_pokemon():
-            print("Player wins!\n")
-            print(ASCII_ART['player_wins'])
-            break
-            
-        # Computer's turn
-        if settings['difficulty']:
-            computer_turn(computer, player, settings['difficulty'])
-        else:
-            computer_turn(computer, player)
-        
-        if not player.active_pokemon.is_alive():
-            print(f"Player's {player.active_pokemon.name} fainted!")
-            print(ASCII_ART['fainted'])
-            input("\t Enter to continue...\n")
-            alive_pokemon = [i for i, pokemon in enumerate(player.pokemon) if pokemon.is_alive()]
-            if alive_pokemon:
-                print("Available Pokemon:")
-                for i, pokemon in enumerate(player.pokemon):
-                    status = "Alive" if pokemon.is_alive() else "Fainted"
-                    print(f"{i+1}. {pokemon.name} ({pokemon.hp}/{pokemon.max_hp} HP, {status})")
-                while True:
-                    swap_choice = input("Choose Pokemon to swap to (1-3): ").strip()
-                    try:
-                        index = int(swap_choice) - 1
-                        if player.swap_pokemon(index):
-                            print(f"{player.name} swapped to {player.active_pokemon.name}!")
-                            break
-                        else:
-                            print("Invalid choice or Pokemon is fainted. Try again.")
-                    except ValueError:
-                        print("Invalid input. Try again.")
+    # the engine applies the rules, this loop only prompts and prints
+    try:
+        while not state.over:
+            if state.to_move == PLAYER:
+                if state.replacing:
+                    with metrics.timer("player_replacement_seconds"):
+                        action = player_replacement(player)
+                else:
+                    display_status(player, computer)
+                    with metrics.timer("player_turn_seconds"):
+                        action = player_turn(player, computer)
+            elif state.replacing:
+                action = computer_action(state, difficulty, rng)
             else:
-                print("Computer wins!\n")
-                print(ASCII_ART['computer_wins'])
-                break
+                with metrics.timer("ai_think_seconds", difficulty=difficulty):
+                    action = computer_turn(state, policy)
+            show_events(state, state.step(action))
+    finally:
+        if log_file:
+            log_file.close()
+
+def choose_pick(manager, unselected, suggestion, positions, page_size=20) -> int:
+    '''
+    Asks for a pick from the pool a page at a time, taking it out of
+    unselected and returning its roster position. Anything that isn't a
+    number is searched for in the roster, see PokemonManager.search.
+    '''
+    roster = manager.pokemon
+    start = 0
+    listing = True
+    while True:
+        more = len(unselected) > page_size
+        if listing:
+            for c, i in enumerate(unselected[start:start + page_size], start + 1):
+                print(f"  {c}. {roster[i].name}")
+            print(f"Suggested pick: {roster[suggestion].name}")
+        listing = True
+        choice = input(f"Pick a Pokemon (1-{len(unselected)})" + (", Enter for more, or type to search: " if more else ": ")).strip()
+        if check_int_choice(choice, range(1, len(unselected) + 1)):
+            return unselected.pop(int(choice) - 1)
+        if not choice and more:
+            start = start + page_size if start + page_size < len(unselected) else 0
+            continue
+        if not choice or choice.isdigit():
+            print("That didn't make sense.")
+            listing = False
+            continue
+        try:
+            found = manager.search(choice)
+        except ValueError as e:
+            print(e)
+            listing = False
+            continue
+        pool = {i: c for c, i in enumerate(unselected, 1)}
+        matches = [(pool[positions[p.name]], p) for p in found if positions.get(p.name) in pool]
+        if not matches:
+            print("Nothing left in the pool matches that.")
+        for c, pokemon in matches[:page_size]:
+            print(f"  {c}. {pokemon.name} ({pokemon.type}, {pokemon.health_points} HP)")
+        listing = False
 
 def check_int_choice(choice, allowable_inputs: list) -> bool:
 
@@ -223,11 +242,11 @@ def settings_menu() -> dict:
         pick_limit = input("Try again. How many pokemon should each player start with? (1-3) ")
         good_pick = check_int_choice(pick_limit, [i+1 for i in range(3)])
 
-    difficulty = input("How good should the computer be? (1-5, 1=easiest, 5=hardest) ")
-    good_difficulty = check_int_choice(difficulty, [1,2,3,4,5])
+    difficulty = input(f"How good should the computer be? (1-{MAX_DIFFICULTY}, 1=easiest, {MAX_DIFFICULTY}=hardest) ")
+    good_difficulty = check_int_choice(difficulty, [i+1 for i in range(MAX_DIFFICULTY)])
     while not good_difficulty:
-        difficulty = input("Try again. How good should the coputer be? (1-5) ")
-        good_difficulty = check_int_choice(difficulty, [1,2,3,4,5])
+        difficulty = input(f"Try again. How good should the coputer be? (1-{MAX_DIFFICULTY}) ")
+        good_difficulty = check_int_choice(difficulty, [i+1 for i in range(MAX_DIFFICULTY)])
 
     print('Settings successfully changed!\n')
     return {
@@ -236,9 +255,9 @@ def settings_menu() -> dict:
     }
 
 
-def main():
+def main(record=None, filename="pokemon.json"):
     ''' outer menu for seleting battle or manager or settings change '''
-    manager = PokemonManager()
+    manager = PokemonManager(filename)
     settings = None
     print('\nWelcome to PokeBattle!')
     while True:
@@ -261,7 +280,7 @@ def main():
             settings = {'pick_limit': 2, 'difficulty': 3}
         match int(menu_choice):
             case 1:
-                battle(settings)
+                battle(settings, manager, record)
             case 2:
                 manager.run()
             case 3:
@@ -316,7 +335,23 @@ r"""
     }
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Pokemon battles against the computer.")
+    parser.add_argument('--file', default="pokemon.json", help="roster to battle with and manage (.db for SQLite)")
+    parser.add_argument('--record', metavar='LOG', help="append a replay log of every battle to LOG")
+    parser.add_argument('--metrics', metavar='FILE', help="collect metrics and write them to FILE on exit (.json for JSON, else Prometheus text)")
+    parser.add_argument('--metrics-port', type=int, help="collect metrics and serve them on this port at /metrics")
+    parser.add_argument('--profile', metavar='FILE', help="run under cProfile and dump the stats to FILE")
+    args = parser.parse_args()
+    if args.metrics or args.metrics_port:
+        metrics.enable()
+    if args.metrics_port:
+        metrics.active.serve(port=args.metrics_port)
+    try:
+        with metrics.profiled(args.profile) if args.profile else nullcontext():
+            main(args.record, args.file)
+    finally:
+        if args.metrics:
+            metrics.active.write(args.metrics)
 
 
 
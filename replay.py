@@ -0,0 +1,126 @@
+import argparse
+import json
+
+from engine import Attack, BattleState, Forfeit, Player, Swap
+from pokemon import PokemonManager
+
+# Battle logs are JSON lines. Each battle is a "start" line with its picks,
+# one "action" line per step with both teams' hp after it, and an "end" line.
+
+class ReplayMismatch(ValueError):
+    pass
+
+def encode_action(action) -> list:
+    if isinstance(action, Attack):
+        return ["attack", action.name]
+    if isinstance(action, Swap):
+        return ["swap", action.index]
+    return ["forfeit"]
+
+def decode_action(data):
+    match data:
+        case ["attack", name]:
+            return Attack(name)
+        case ["swap", index]:
+            return Swap(index)
+        case ["forfeit"]:
+            return Forfeit()
+    raise ValueError(f"Unknown action {data!r} in battle log.")
+
+class BattleLog:
+    ''' records battles to a file opened for writing (or appending) text '''
+
+    def __init__(self, f):
+        self.f = f
+
+    def _write(self, line):
+        self.f.write(json.dumps(line, separators=(',', ':')) + "\n")
+
+    def start(self, state: BattleState, seed=None, difficulty=None, **info):
+        ''' logs the battle's setup and records every step taken from now on '''
+        self._write({
+            "type": "start",
+            "seed": seed,
+            "difficulty": difficulty,
+            "picks": [[p.name for p in side.pokemon] for side in state.sides],
+            "first": state.to_move,
+            **info,
+        })
+        state.recorder = self
+
+    def record(self, state: BattleState, side: int, action):
+        self._write({"type": "action", "side": side, "action": encode_action(action), "hp": [list(s.hp) for s in state.sides]})
+        if state.over:
+            self._write({"type": "end", "winner": state.winner, "turns": state.turns})
+
+def read_battles(f):
+    ''' yields each battle in a log as a dict with its start line, its action lines and its end line (or None) '''
+    battle = None
+    for line in f:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if entry["type"] == "start":
+            if battle is not None:
+                yield battle
+            battle = {"start": entry, "actions": [], "end": None}
+        elif battle is None:
+            raise ValueError("Battle log doesn't begin with a start line.")
+        elif entry["type"] == "action":
+            battle["actions"].append(entry)
+        else:
+            battle["end"] = entry
+    if battle is not None:
+        yield battle
+
+def replay(battle: dict, by_name: dict, damage=None, check=True) -> BattleState:
+    '''
+    Plays a logged battle again with the pokemon in by_name. With check set,
+    a ReplayMismatch is raised as soon as the hp differ from the log's, so a
+    battle recorded against an older roster can be replayed with check off to
+    see how the same moves turn out now.
+    '''
+    start = battle["start"]
+    try:
+        teams = [[by_name[name] for name in picks] for picks in start["picks"]]
+    except KeyError as e:
+        raise ReplayMismatch(f"{e.args[0]} is no longer in the roster.")
+    state = BattleState(Player("Player", teams[0]), Player("Computer", teams[1]), start["first"], damage)
+    for turn, entry in enumerate(battle["actions"], 1):
+        if state.over:
+            break
+        if check and entry["side"] != state.to_move:
+            raise ReplayMismatch(f"Action {turn}: expected side {entry['side']} to move, not side {state.to_move}.")
+        state.step(decode_action(entry["action"]))
+        hp = [list(side.hp) for side in state.sides]
+        if check and hp != entry["hp"]:
+            raise ReplayMismatch(f"Action {turn}: hp {hp}, log says {entry['hp']}.")
+    end = battle["end"]
+    if check and end is not None and state.winner != end["winner"]:
+        raise ReplayMismatch(f"Winner {state.winner}, log says {end['winner']}.")
+    return state
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logged battles and check they still play out the same.")
+    parser.add_argument('log')
+    parser.add_argument('--file', default="pokemon.json", help="roster to replay against")
+    parser.add_argument('--no-check', action='store_true', help="only compare who wins")
+    args = parser.parse_args()
+
+    manager = PokemonManager(args.file)
+    battles = same = failed = 0
+    with open(args.log) as f:
+        for battle in read_battles(f):
+            battles += 1
+            try:
+                state = replay(battle, manager.by_name, manager.damage, check=not args.no_check)
+            except ValueError as e:
+                failed += 1
+                print(f"Battle {battles}: {e}")
+                continue
+            end = battle["end"]
+            same += end is not None and state.winner == end["winner"]
+    print(f"Replayed {battles} battles: {same} with the same winner, {failed} that couldn't be replayed.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+# Simulation results kept next to the roster they came from, in a SQLite file.
+# Every result is keyed by a hash of the pokemon records that played in it
+# (names, stats, attacks, weakness and resistance), the difficulties and the
+# seeds, and remembers which version of each pokemon it used, so an edit to
+# the roster drops only the results that edited pokemon played in.
+
+# part of every key; bump it when the battle rules or the computer players
+# change, so results from the old ones are never reused
+VERSION = 2
+
+def results_path(source: str) -> str:
+    return source + ".results"
+
+def record_hash(record: dict) -> str:
+    # attack order is kept, since the computer players look at attacks in order
+    return hashlib.sha256(json.dumps(record, separators=(",", ":")).encode()).hexdigest()[:32]
+
+def result_key(*parts) -> str:
+    return hashlib.sha256(json.dumps([VERSION, *parts], separators=(",", ":")).encode()).hexdigest()
+
+class ResultCache:
+    '''
+    Results of simulations keyed by result_key(), holding at most max_entries
+    and dropping the least recently used beyond that. Values are anything
+    JSON can hold. Each result lists its members, the (name, record_hash) of
+    every pokemon it depends on, which is what retain() and update() go by.
+    '''
+
+    def __init__(self, path: str, max_entries=200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, used INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS members (
+                key TEXT NOT NULL REFERENCES results (key) ON DELETE CASCADE,
+                name TEXT NOT NULL,
+                hash TEXT NOT NULL
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS members_key ON members (key)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS members_name ON members (name)")
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get_many(self, keys) -> dict:
+        ''' the cached values of those keys that have one, marking them as just used '''
+        found = {}
+        keys = list(keys)
+        now = time.time_ns()
+        with self.db:
+            # SQLite takes at most 999 parameters in older builds
+            for start in range(0, len(keys), 900):
+                batch = keys[start:start + 900]
+                marks = ",".join("?" * len(batch))
+                for key, value in self.db.execute(f"SELECT key, value FROM results WHERE key IN ({marks})", batch):
+                    found[key] = json.loads(value)
+                self.db.execute(f"UPDATE results SET used = ? WHERE key IN ({marks})", [now, *batch])
+        return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        ''' stores (key, value, members) items, then evicts down to max_entries '''
+        now = time.time_ns()
+        with self.db:
+            for key, value, members in items:
+                self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.db.execute("INSERT INTO results VALUES (?, ?, ?)", (key, json.dumps(value), now))
+                self.db.executemany("INSERT INTO members VALUES (?, ?, ?)", ((key, name, digest) for name, digest in members))
+            extra = len(self) - self.max_entries
+            if extra > 0:
+                self.db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)", (extra,))
+
+    def put(self, key: str, value, members):
+        self.put_many([(key, value, members)])
+
+    def update(self, changed: dict[str, str | None]) -> int:
+        '''
+        Drops results that used a pokemon in changed as it was before: any
+        version but the given hash, or any version at all where it's None
+        (the pokemon is gone). Returns how many were dropped.
+        '''
+        before = len(self)
+        with self.db:
+            for name, digest in changed.items():
+                self.db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM members WHERE name = ? AND hash IS NOT ?)",
+                    (name, digest),
+                )
+        return before - len(self)
+
+    def retain(self, current: dict[str, str]) -> int:
+        ''' drops results that used any pokemon not in current, name -> record_hash, as it is now '''
+        before = len(self)
+        with self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS current (name TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+            self.db.execute("DELETE FROM current")
+            self.db.executemany("INSERT OR REPLACE INTO current VALUES (?, ?)", current.items())
+            self.db.execute(
+                """DELETE FROM results WHERE key IN (
+                    SELECT members.key FROM members
+                    LEFT JOIN current ON current.name = members.name AND current.hash = members.hash
+                    WHERE current.name IS NULL
+                )"""
+            )
+        return before - len(self)
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM results")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
+import metrics
+from ai import SEARCH_DEPTHS, computer_policy
+from engine import COMPUTER, PLAYER, Attack, BattleState, Forfeit, Player, Swap, computer_action
+from pokemon import PokemonManager
+
+# Line-based protocol: clients send one command per line, the server answers
+# with one JSON object per line. Once a battle is set up both players get a
+# "matched" message saying which side they are, then "draft" when it's their
+# pick and "turn" when it's their move. loadtest.py is a client for it.
+#
+#   PLAY [pick_limit] [difficulty]   battle the computer
+#   JOIN <room> [pick_limit]         battle whoever else joins the same room
+#   PICK <name>                      draft a pokemon when it's your pick
+#   ATTACK <attack name>             on your turn
+#   SWAP <n>                         on your turn, or to replace a fainted pokemon
+#   FORFEIT                          on your turn
+#   QUIT
+HELP = ["PLAY [pick_limit] [difficulty]", "JOIN <room> [pick_limit]", "PICK <name>", "ATTACK <attack name>", "SWAP <n>", "FORFEIT", "QUIT"]
+
+class Session:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.match = None
+        self.side = None
+
+    def send(self, **message):
+        self.writer.write((json.dumps(message) + "\n").encode())
+
+class Match:
+    def __init__(self, server, sessions, pick_limit, difficulty=2):
+        self.server = server
+        # sessions[side] is None for the computer
+        self.sessions = sessions
+        self.pick_limit = pick_limit
+        self.difficulty = difficulty
+        self.pool = list(server.manager.by_name)
+        self.picks = ([], [])
+        self.picking = PLAYER
+        self.state = None
+        self.finished = False
+        self.rng = random.Random()
+        self.policy = computer_policy(difficulty, self.rng, server.deadline)
+        for side, session in enumerate(sessions):
+            if session is not None:
+                session.match, session.side = self, side
+
+    def broadcast(self, **message):
+        for session in self.sessions:
+            if session is not None:
+                session.send(**message)
+
+    def _status(self, side):
+        def team(player):
+            return {"team": [p.name for p in player.pokemon], "hp": list(player.hp), "active": player.active_index}
+        return {"you": team(self.state.sides[side]), "opponent": team(self.state.sides[1 - side])}
+
+    def prompt(self):
+        if self.finished:
+            return
+        if self.state is None:
+            session = self.sessions[self.picking]
+            if session is not None:
+                session.send(type="draft", pool=self.pool, picks=self.picks[self.picking], picks_left=self.pick_limit - len(self.picks[self.picking]))
+            return
+        if self.state.over:
+            self.finished = True
+            for side, session in enumerate(self.sessions):
+                if session is not None:
+                    session.send(type="over", winner=self.state.winner, you_won=self.state.winner == side)
+            return
+        session = self.sessions[self.state.to_move]
+        if session is not None:
+            actions = []
+            for action in self.state.legal_actions():
+                if isinstance(action, Attack):
+                    actions.append(f"ATTACK {action.name}")
+                elif isinstance(action, Swap):
+                    actions.append(f"SWAP {action.index + 1}")
+                else:
+                    actions.append("FORFEIT")
+            session.send(type="turn", replacing=self.state.replacing, actions=actions, **self._status(self.state.to_move))
+
+    async def start(self):
+        # in PvP the second player would otherwise hear nothing until the first one picks
+        for side, session in enumerate(self.sessions):
+            if session is not None:
+                opponent = "computer" if self.sessions[1 - side] is None else "player"
+                session.send(type="matched", side=side, opponent=opponent, pick_limit=self.pick_limit)
+        await self._computer_picks()
+        self.prompt()
+
+    async def pick(self, side, name):
+        if self.state is not None or self.finished:
+            raise ValueError("The draft is over.")
+        if side != self.picking:
+            raise ValueError("It's not your pick.")
+        if name not in self.pool:
+            raise ValueError(f"{name} isn't available.")
+        self._take(side, name)
+        await self._computer_picks()
+        self.prompt()
+
+    def _take(self, side, name):
+        self.pool.remove(name)
+        self.picks[side].append(name)
+        self.broadcast(type="picked", side=side, name=name)
+        self.picking = 1 - side
+        if len(self.picks[COMPUTER]) == self.pick_limit:
+            by_name = self.server.manager.by_name
+            teams = [[by_name[name] for name in picks] for picks in self.picks]
+            names = ["Player", "Computer" if self.sessions[COMPUTER] is None else "Player 2"]
+            self.state = BattleState(Player(names[0], teams[0]), Player(names[1], teams[1]), damage=self.server.manager.damage)
+            for side, session in enumerate(self.sessions):
+                if session is not None:
+                    session.send(type="battle", side=side, **self._status(side))
+
+    async def _computer_picks(self):
+        while self.state is None and self.sessions[self.picking] is None:
+            self._take(self.picking, self.rng.choice(self.pool))
+        await self._computer_moves()
+
+    async def act(self, side, action):
+        if self.state is None or self.finished:
+            raise ValueError("There is no battle going on.")
+        if self.state.to_move != side:
+            raise ValueError("It's not your turn.")
+        self.broadcast(type="events", events=[asdict(e) for e in self.state.step(action)])
+        await self._computer_moves()
+        self.prompt()
+
+    async def _computer_moves(self):
+        # the computer moves until it's a person's turn; searching happens off the event loop
+        loop = asyncio.get_running_loop()
+        while self.state is not None and not self.state.over and self.sessions[self.state.to_move] is None:
+            if self.state.replacing:
+                action = computer_action(self.state, self.difficulty, self.rng)
+            else:
+                start = time.perf_counter()
+                if self.difficulty in SEARCH_DEPTHS:
+                    action = await loop.run_in_executor(self.server.executor, self.policy, self.state)
+                else:
+                    action = self.policy(self.state)
+                if metrics.active is not None:
+                    metrics.active.observe("ai_think_seconds", time.perf_counter() - start, difficulty=self.difficulty)
+            self.broadcast(type="events", events=[asdict(e) for e in self.state.step(action)])
+
+    def leave(self, side):
+        if self.finished:
+            return
+        self.finished = True
+        for other, session in enumerate(self.sessions):
+            if session is not None and other != side:
+                session.send(type="over", winner=other, you_won=True, reason="opponent left")
+
+class BattleServer:
+    def __init__(self, manager: PokemonManager, executor=None, deadline=0.05):
+        self.manager = manager
+        self.executor = executor or ThreadPoolExecutor()
+        self.deadline = deadline
+        # PvP rooms with one player waiting: room -> (session, pick_limit)
+        self.rooms: dict[str, tuple[Session, int]] = {}
+        self.sessions = 0
+
+    async def handle(self, reader, writer):
+        session = Session(reader, writer)
+        self.sessions += 1
+        metrics.count("server_sessions_total")
+        session.send(type="hello", commands=HELP)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode(errors='replace').split()
+                if not words:
+                    continue
+                if words[0].upper() == "QUIT":
+                    break
+                try:
+                    await self.command(session, words[0].upper(), words[1:])
+                except ValueError as e:
+                    session.send(type="error", message=str(e))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            if session.match is not None:
+                session.match.leave(session.side)
+            room = self._room_of(session)
+            if room is not None:
+                del self.rooms[room]
+            writer.close()
+
+    def _room_of(self, session) -> str | None:
+        ''' the room session is waiting in, if any '''
+        for room, (waiting, _) in self.rooms.items():
+            if waiting is session:
+                return room
+        return None
+
+    def _number(self, args, i, default, allowed):
+        try:
+            value = int(args[i]) if len(args) > i else default
+        except ValueError:
+            raise ValueError(f"{args[i]} isn't a number.")
+        if value not in allowed:
+            raise ValueError(f"{value} must be between {min(allowed)} and {max(allowed)}.")
+        return value
+
+    async def command(self, session, command, args):
+        match command:
+            case "PLAY" | "JOIN" if session.match is not None and not session.match.finished:
+                raise ValueError("Finish this battle first.")
+            case "PLAY" | "JOIN" if self._room_of(session) is not None:
+                # joining would pair it with itself, and a battle meanwhile would be cut off when someone joins
+                raise ValueError(f"You're waiting in room {self._room_of(session)}, wait for someone to JOIN it first.")
+            case "PLAY":
+                pick_limit = self._number(args, 0, 2, range(1, len(self.manager.pokemon) // 2 + 1))
+                difficulty = self._number(args, 1, 2, range(1, max(SEARCH_DEPTHS) + 1))
+                await Match(self, [session, None], pick_limit, difficulty).start()
+            case "JOIN":
+                if not args:
+                    raise ValueError("JOIN needs a room name.")
+                room = args[0]
+                if room in self.rooms:
+                    first, pick_limit = self.rooms.pop(room)
+                    await Match(self, [first, session], pick_limit).start()
+                else:
+                    pick_limit = self._number(args, 1, 2, range(1, len(self.manager.pokemon) // 2 + 1))
+                    self.rooms[room] = (session, pick_limit)
+                    session.send(type="waiting", room=room)
+            case "PICK" | "ATTACK" | "SWAP" | "FORFEIT" if session.match is None:
+                raise ValueError("Start a battle with PLAY or JOIN first.")
+            case "PICK":
+                await session.match.pick(session.side, " ".join(args))
+            case "ATTACK":
+                await session.match.act(session.side, Attack(" ".join(args)))
+            case "SWAP":
+                if not args or not args[0].isdigit():
+                    raise ValueError("SWAP needs the number of a pokemon on your team.")
+                await session.match.act(session.side, Swap(int(args[0]) - 1))
+            case "FORFEIT":
+                await session.match.act(session.side, Forfeit())
+            case _:
+                raise ValueError(f"Unknown command {command}.")
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve pokemon battles over TCP.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--file', default="pokemon.json")
+    parser.add_argument('--deadline', type=float, default=0.05, help="seconds the computer may think per move")
+    parser.add_argument('--metrics-port', type=int, help="collect metrics and serve them on this port at /metrics")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.enable().serve(args.host, args.metrics_port)
+
+    manager = PokemonManager(args.file)
+    print(f"Serving {len(manager.pokemon)} pokemon on {args.host}:{args.port}")
+    asyncio.run(BattleServer(manager, deadline=args.deadline).serve(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import os
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from ai import BATCH_NODES, SEARCH_DEPTHS, computer_policy
+from endgame import EndgameSolver
+from engine import BattleState, Player
+from pokemon import DamageMatrix, Pokemon, PokemonManager
+from replay import BattleLog
+from snapshot import Snapshot
+
+# roster handed to each worker process once, instead of once per chunk
+_roster: list[Pokemon] = []
+_damage = DamageMatrix()
+_endgame = EndgameSolver()
+
+# battles still going after this many turns are stuck, e.g. down to pokemon
+# that can't hurt each other, and count as a draw
+MAX_TURNS = 1_000
+
+def _init_worker(roster):
+    global _roster, _damage
+    # a Snapshot arrives as just its path, and the worker maps the same file
+    _roster = [Pokemon(**record) for record in roster] if isinstance(roster, Snapshot) else roster
+    _damage = DamageMatrix(_roster)
+
+def draft(roster_size, pick_limit, rng) -> tuple[list[int], list[int]]:
+    ''' both sides pick at random in turn from a common pool, like the computer does in battle() '''
+    unselected = list(range(roster_size))
+    picks = ([], [])
+    while len(picks[1]) < pick_limit:
+        for side in picks:
+            side.append(unselected.pop(rng.randrange(len(unselected))))
+    return picks
+
+def team_key(roster, team) -> tuple[str, ...]:
+    return tuple(sorted(roster[i].name for i in team))
+
+def run_battle(roster, picks, difficulty, rng, damage=None, log=None, endgame=None, **info) -> float:
+    '''
+    Plays a battle and returns the chance side 0 won: 1.0 or 0.0, 0.5 for a
+    battle that goes on past MAX_TURNS, or with an EndgameSolver the exact
+    odds from the point the battle was small enough to solve, when neither
+    side searches and there's no log to write.
+    '''
+    player = Player("Player", [roster[i] for i in picks[0]])
+    computer = Player("Computer", [roster[i] for i in picks[1]])
+    state = BattleState(player, computer, damage=damage)
+    if log is not None:
+        log.start(state, difficulty=difficulty, **info)
+    # one difficulty for both sides, or a (player, computer) pair
+    difficulties = difficulty if isinstance(difficulty, tuple) else (difficulty, difficulty)
+    # searching sides get a node budget instead of a clock, so a battle plays the same on any machine
+    policies = tuple(computer_policy(d, rng, deadline=None, max_nodes=BATCH_NODES) for d in difficulties)
+    if log is not None or any(d in SEARCH_DEPTHS for d in difficulties):
+        endgame = None
+    damages = endgame.damages(state) if endgame is not None else None
+    alive = None
+    while state.winner is None:
+        if state.turns >= MAX_TURNS:
+            return 0.5
+        if endgame is not None and not state.replacing:
+            counts = (sum(1 for hp in player.hp if hp), sum(1 for hp in computer.hp if hp))
+            # only worth asking again once a pokemon has fainted
+            if counts != alive and max(counts) <= endgame.max_alive:
+                chance = endgame.win_chance(state, difficulties, damages)
+                if chance is not None:
+                    return chance
+            alive = counts
+        state.step(policies[state.to_move](state))
+    return float(state.winner == 0)
+
+def chunk_rng(seed, chunk) -> random.Random:
+    # every chunk gets its own stream, so results don't depend on which worker ran it
+    return random.Random(f"{seed}/{chunk}")
+
+def _run_chunk(args):
+    chunk, battles, seed, pick_limit, difficulty, log_dir, exact = args
+    rng = chunk_rng(seed, chunk)
+    log_file = open(os.path.join(log_dir, f"chunk-{chunk:05d}.jsonl"), 'w') if log_dir else None
+    log = BattleLog(log_file) if log_file else None
+    record = defaultdict(lambda: [0, 0])  # (team_a, team_b) -> [team_a wins, games]; solved endgames count their odds
+    for i in range(battles):
+        picks = draft(len(_roster), pick_limit, rng)
+        a_won = run_battle(_roster, picks, difficulty, rng, _damage, log, _endgame if exact else None, seed=f"{seed}/{chunk}", battle=i)
+        team_a, team_b = team_key(_roster, picks[0]), team_key(_roster, picks[1])
+        if team_b < team_a:
+            team_a, team_b, a_won = team_b, team_a, 1 - a_won
+        entry = record[(team_a, team_b)]
+        entry[0] += a_won
+        entry[1] += 1
+    if log_file:
+        log_file.close()
+    return dict(record)
+
+def simulate(roster, pick_limit=2, difficulty=2, battles=1000, seed=0, workers=None, chunk_size=500, log_dir=None, exact=False) -> dict:
+    '''
+    Plays `battles` computer-vs-computer battles with random drafts from `roster`
+    and returns win rates per team and per pairing. `roster` is a list of
+    Pokemon or a Snapshot. Results only depend on `seed` and `chunk_size`,
+    never on the number of workers. With log_dir set, every chunk writes a
+    replay log of its battles there. With exact set, a battle between
+    dice-rolling sides stops as soon as it's small enough to solve and counts
+    as its exact odds of winning, which makes win rates less noisy for the
+    time spent solving.
+    '''
+    if not isinstance(roster, Snapshot):
+        roster = list(roster)
+    if 2 * pick_limit > len(roster):
+        raise ValueError(f"A roster of {len(roster)} pokemon can't field two teams of {pick_limit}.")
+    jobs = []
+    for chunk, start in enumerate(range(0, battles, chunk_size)):
+        jobs.append((chunk, min(chunk_size, battles - start), seed, pick_limit, difficulty, log_dir, exact))
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(roster)
+        results = map(_run_chunk, jobs)
+        return _summarize(battles, results)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(roster,)) as pool:
+        return _summarize(battles, pool.map(_run_chunk, jobs))
+
+def _summarize(battles, results) -> dict:
+    pairings = defaultdict(lambda: [0, 0])
+    teams = defaultdict(lambda: [0, 0])
+    for record in results:
+        for (team_a, team_b), (a_wins, games) in record.items():
+            pairings[(team_a, team_b)][0] += a_wins
+            pairings[(team_a, team_b)][1] += games
+            teams[team_a][0] += a_wins
+            teams[team_a][1] += games
+            teams[team_b][0] += games - a_wins
+            teams[team_b][1] += games
+    return {
+        'battles': battles,
+        'teams': {team: wins / games for team, (wins, games) in teams.items()},
+        'pairings': {pair: wins / games for pair, (wins, games) in pairings.items()},
+        'games': {pair: games for pair, (_, games) in pairings.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate computer-vs-computer battles to measure win rates.")
+    parser.add_argument('--file', default="pokemon.json")
+    parser.add_argument('-n', '--battles', type=int, default=10000)
+    parser.add_argument('--pick-limit', type=int, default=2)
+    parser.add_argument('--difficulty', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--top', type=int, default=10, help="how many teams to print")
+    parser.add_argument('--log-dir', help="write replay logs of every battle to this directory")
+    parser.add_argument('--exact', action='store_true', help="count endgames at their exact odds instead of playing them out")
+    args = parser.parse_args()
+
+    manager = PokemonManager(args.file)
+    roster = manager.snapshot() or manager.pokemon
+    result = simulate(roster, args.pick_limit, args.difficulty, args.battles, args.seed, args.workers, log_dir=args.log_dir, exact=args.exact)
+    print(f"Simulated {result['battles']} battles.")
+    ranked = sorted(result['teams'].items(), key=lambda item: item[1], reverse=True)
+    for team, rate in ranked[:args.top]:
+        print(f"  {rate:6.1%}  {', '.join(team)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import json
+import mmap
+import os
+import struct
+
+# A compiled, read-only copy of a JSON roster:
+#   header | fixed-width pokemon records | fixed-width attack records | string table
+# Strings are (offset, length) pairs into the string table, which also holds the
+# load errors of the source as JSON. The header remembers the source's mtime and
+# size, so a snapshot that no longer matches its source is rebuilt.
+MAGIC = b"PKSNAP\0\0"
+# bump it when what a load accepts changes, so older snapshots are rebuilt
+VERSION = 2
+HEADER = struct.Struct("<8sIqqIIIII")  # magic, version, mtime_ns, size, count, attacks, strings, errors offset, errors length
+RECORD = struct.Struct("<8IIHHI")  # name, type, weakness, resistance, health_points, stage, attack count, first attack
+ATTACK = struct.Struct("<III")  # name, damage
+
+def snapshot_path(source: str) -> str:
+    return source + ".snap"
+
+def _source_stamp(source: str) -> tuple[int, int]:
+    stat = os.stat(source)
+    return stat.st_mtime_ns, stat.st_size
+
+class Snapshot:
+    '''
+    A memory-mapped snapshot. Records are decoded on demand; worker processes
+    that unpickle a Snapshot map the same file instead of copying it.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, mtime_ns, size, self._count, self._attack_count,
+         self._strings, errors_offset, errors_length) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {VERSION} roster snapshot")
+        self.stamp = (mtime_ns, size)
+        self._attacks = HEADER.size + self._count * RECORD.size
+        self.errors = json.loads(self._map[errors_offset:errors_offset + errors_length])
+
+    def __reduce__(self):
+        return (Snapshot, (self.path,))
+
+    def __len__(self):
+        return self._count
+
+    def _string(self, offset, length) -> str:
+        start = self._strings + offset
+        return str(self._map[start:start + length], 'utf-8')
+
+    def record(self, index: int) -> dict:
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        (name, name_len, kind, kind_len, weakness, weakness_len, resistance, resistance_len,
+         health_points, stage, attack_count, first_attack) = RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+        attacks = {}
+        for i in range(first_attack, first_attack + attack_count):
+            attack, attack_len, damage = ATTACK.unpack_from(self._map, self._attacks + i * ATTACK.size)
+            attacks[self._string(attack, attack_len)] = damage
+        return {
+            "name": self._string(name, name_len),
+            "type": self._string(kind, kind_len),
+            "health_points": health_points,
+            "stage": stage,
+            "attacks": attacks,
+            "weakness": self._string(weakness, weakness_len),
+            "resistance": self._string(resistance, resistance_len),
+        }
+
+    def __iter__(self):
+        return (self.record(i) for i in range(self._count))
+
+    def fresh_for(self, source: str) -> bool:
+        return os.path.exists(source) and self.stamp == _source_stamp(source)
+
+    def close(self):
+        self._map.close()
+
+def write_snapshot(path: str, stamp: tuple[int, int], records: list[dict], errors: list[dict]):
+    ''' writes normalized records (and the errors met reading them) to a new snapshot, atomically '''
+    strings = bytearray()
+    offsets = {}
+
+    def string(value):
+        if value not in offsets:
+            offsets[value] = len(strings)
+            strings.extend(value.encode('utf-8'))
+        return offsets[value], len(value.encode('utf-8'))
+
+    body = bytearray()
+    attacks = bytearray()
+    attack_count = 0
+    for record in records:
+        body += RECORD.pack(
+            *string(record["name"]), *string(record["type"]),
+            *string(record["weakness"]), *string(record["resistance"] or ""),
+            record["health_points"], record["stage"], len(record["attacks"]), attack_count,
+        )
+        for attack, damage in record["attacks"].items():
+            attacks += ATTACK.pack(*string(attack), damage)
+            attack_count += 1
+    strings_offset = HEADER.size + len(body) + len(attacks)
+    error_bytes = json.dumps(errors).encode('utf-8')
+    header = HEADER.pack(
+        MAGIC, VERSION, *stamp, len(records), attack_count,
+        strings_offset, strings_offset + len(strings), len(error_bytes),
+    )
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(header + body + attacks + strings + error_bytes)
+    os.replace(temp, path)
+
+def open_snapshot(source: str, compile) -> Snapshot:
+    '''
+    The snapshot of a JSON roster, rebuilt first if it is missing or older than
+    the roster. compile() is only called then, and returns (records, errors).
+    '''
+    path = snapshot_path(source)
+    try:
+        snapshot = Snapshot(path)
+        if snapshot.fresh_for(source):
+            return snapshot
+        snapshot.close()
+    except (OSError, ValueError, struct.error):
+        pass
+    stamp = _source_stamp(source)
+    records, errors = compile()
+    write_snapshot(path, stamp, records, errors)
+    return Snapshot(path)
@@ -0,0 +1,107 @@
+import json
+import sqlite3
+import sys
+
+class SqliteStore:
+    '''
+    Roster kept in a SQLite file, one row per pokemon, keyed by name.
+    Changes write only the affected row instead of the whole roster.
+    Records are plain dicts with the same keys as pokemon.json entries.
+    '''
+
+    SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS pokemon (
+                name TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                health_points INTEGER NOT NULL,
+                stage INTEGER NOT NULL,
+                attacks TEXT NOT NULL,
+                weakness TEXT NOT NULL,
+                resistance TEXT
+            )"""
+        )
+        # rosters are always loaded whole, so nothing looks pokemon up by type;
+        # files made before that still have the index, which only slows writes
+        self.db.execute("DROP INDEX IF EXISTS pokemon_type")
+        self.db.commit()
+
+    @classmethod
+    def handles(cls, filename: str) -> bool:
+        return filename.endswith(cls.SUFFIXES)
+
+    def _record(self, row) -> dict:
+        name, pokemon_type, health_points, stage, attacks, weakness, resistance = row
+        return {
+            "name": name,
+            "type": pokemon_type,
+            "health_points": health_points,
+            "stage": stage,
+            "attacks": json.loads(attacks),
+            "weakness": weakness,
+            "resistance": resistance,
+        }
+
+    def _row(self, record: dict) -> tuple:
+        return (
+            record["name"], record["type"], record["health_points"], record["stage"],
+            json.dumps(record["attacks"]), record["weakness"], record["resistance"],
+        )
+
+    def load(self) -> list[dict]:
+        rows = self.db.execute("SELECT name, type, health_points, stage, attacks, weakness, resistance FROM pokemon ORDER BY rowid")
+        return [self._record(row) for row in rows]
+
+    def put(self, record: dict, old_name: str | None = None):
+        '''
+        Inserts a new pokemon, or with old_name (its name before the edit, which
+        may be the same) updates an existing one. A name that's already taken
+        raises sqlite3.IntegrityError instead of replacing the other pokemon.
+        '''
+        with self.db:
+            self._put(record, old_name)
+
+    def _put(self, record, old_name):
+        if old_name is None:
+            self.db.execute("INSERT INTO pokemon VALUES (?, ?, ?, ?, ?, ?, ?)", self._row(record))
+        else:
+            # an update keeps the rowid, and with it the roster order, of the pokemon
+            self.db.execute(
+                "UPDATE pokemon SET name = ?, type = ?, health_points = ?, stage = ?, attacks = ?, weakness = ?, resistance = ? WHERE name = ?",
+                self._row(record) + (old_name,),
+            )
+
+    def apply(self, puts: list[tuple[dict, str | None]], deletes: list[str]):
+        ''' many puts (record, old_name), as for put, and deletes in one transaction '''
+        with self.db:
+            self.db.executemany("DELETE FROM pokemon WHERE name = ?", ((name,) for name in deletes))
+            for record, old_name in puts:
+                self._put(record, old_name)
+
+    def delete(self, name: str):
+        with self.db:
+            self.db.execute("DELETE FROM pokemon WHERE name = ?", (name,))
+
+    def replace_all(self, records: list[dict]):
+        with self.db:
+            self.db.execute("DELETE FROM pokemon")
+            self.db.executemany("INSERT OR REPLACE INTO pokemon VALUES (?, ?, ?, ?, ?, ?, ?)", map(self._row, records))
+
+    def close(self):
+        self.db.close()
+
+if __name__ == "__main__":
+    # python store.py pokemon.json pokemon.db
+    if len(sys.argv) != 3:
+        sys.exit("usage: python store.py ROSTER.json ROSTER.db")
+    with open(sys.argv[1]) as f:
+        records = json.load(f)
+    store = SqliteStore(sys.argv[2])
+    store.replace_all(records)
+    print(f"Imported {len(records)} pokemon into {sys.argv[2]}.")
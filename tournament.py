@@ -0,0 +1,259 @@
+import argparse
+import itertools
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import simulate
+from ai import MAX_DIFFICULTY
+from pokemon import Pokemon, PokemonManager, normal_type
+from results import ResultCache, record_hash, result_key, results_path
+from snapshot import Snapshot
+
+K_FACTOR = 32
+START_RATING = 1500.0
+
+def dominates(a: Pokemon, b: Pokemon) -> bool:
+    '''
+    a is at least as good as b in every way the battle rules care about, and
+    better in one: the same type, so its attacks land the same way, a weakness
+    that's b's or none, a resistance that's b's or b resists nothing, no less
+    hp, and no weaker best or average attack.
+    '''
+    if normal_type(a.type) != normal_type(b.type):
+        return False
+    if normal_type(a.weakness) not in (normal_type(b.weakness), ""):
+        return False
+    if normal_type(b.resistance) not in (normal_type(a.resistance), ""):
+        return False
+    a_damage, b_damage = list(a.attacks.values()) or [0], list(b.attacks.values()) or [0]
+    a_stats = (a.health_points, max(a_damage), sum(a_damage) / len(a_damage))
+    b_stats = (b.health_points, max(b_damage), sum(b_damage) / len(b_damage))
+    profile_a = (normal_type(a.weakness), normal_type(a.resistance))
+    profile_b = (normal_type(b.weakness), normal_type(b.resistance))
+    return all(x >= y for x, y in zip(a_stats, b_stats)) and (a_stats != b_stats or profile_a != profile_b)
+
+def teams(roster, pick_limit, prune=True):
+    '''
+    Yields every team of pick_limit pokemon from the roster. With prune set,
+    teams are left out when they hold a pokemon that another pokemon outside
+    the team dominates, since swapping it in would make a team at least as
+    good. A species dominated by pick_limit others or more can't be on any
+    team that's kept, so it's dropped before teams are put together.
+    '''
+    if not prune:
+        yield from itertools.combinations(range(len(roster)), pick_limit)
+        return
+    dominated_by = {
+        i: [j for j, other in enumerate(roster) if j != i and dominates(other, pokemon)]
+        for i, pokemon in enumerate(roster)
+    }
+    candidates = [i for i in range(len(roster)) if len(dominated_by[i]) < pick_limit]
+    for team in itertools.combinations(candidates, pick_limit):
+        members = set(team)
+        if not any(j not in members for i in team for j in dominated_by[i]):
+            yield team
+
+def entrant_key(roster, team, difficulty) -> str:
+    return "+".join(roster[i].name for i in team) + f"@{difficulty}"
+
+def _play_match(job):
+    a, b, games, seed = job
+    # the same pairing always gets the same seed, so a resumed run plays it the same way
+    rng = random.Random(f"{seed}/{a[0]}/{b[0]}")
+    # workers are set up by simulate's initializer, which also takes a Snapshot
+    roster, damage = simulate._roster, simulate._damage
+    a_wins = 0
+    for game in range(games):
+        # take turns moving first
+        if game % 2 == 0:
+            a_wins += simulate.run_battle(roster, (a[1], b[1]), (a[2], b[2]), rng, damage)
+        else:
+            a_wins += 1 - simulate.run_battle(roster, (b[1], a[1]), (b[2], a[2]), rng, damage)
+    return a[0], b[0], a_wins / games
+
+class Tournament:
+    '''
+    Round-robin or Swiss tournament between (team, difficulty) entrants with
+    Elo ratings for every entrant and every species. Progress is written to a
+    JSON checkpoint after each round, and a run started with the same
+    checkpoint and settings picks up where the last one stopped. With a
+    ResultCache, matches already played by the same teams, difficulties and
+    seed are taken from it instead of being played again. roster is a list
+    of Pokemon or a Snapshot, which worker processes map instead of being
+    sent the whole roster.
+    '''
+
+    def __init__(self, roster, pick_limit=2, difficulties=(2,), games=10, seed=0, prune=True, checkpoint=None, cache: ResultCache | None = None):
+        self.snapshot = roster if isinstance(roster, Snapshot) else None
+        self.roster = [Pokemon(**record) for record in roster] if self.snapshot is not None else list(roster)
+        self.cache = cache
+        self.cache_hits = 0
+        self.hashes = [record_hash(p.to_record()) for p in self.roster] if cache is not None else []
+        self.config = {"pick_limit": pick_limit, "difficulties": list(difficulties), "games": games, "seed": seed, "prune": prune}
+        self.games = games
+        self.seed = seed
+        self.checkpoint = checkpoint
+        self.entrants = {
+            entrant_key(self.roster, team, difficulty): (team, difficulty)
+            for team in teams(self.roster, pick_limit, prune)
+            for difficulty in difficulties
+        }
+        self.ratings = {key: START_RATING for key in self.entrants}
+        self.species = {p.name: START_RATING for p in self.roster}
+        self.played: set[tuple[str, str]] = set()
+        self.round = 0
+        if checkpoint and os.path.exists(checkpoint):
+            self._resume()
+
+    def _resume(self):
+        with open(self.checkpoint) as f:
+            saved = json.load(f)
+        if saved["config"] != self.config:
+            raise ValueError(f"{self.checkpoint} is from a tournament with different settings.")
+        self.ratings.update(saved["ratings"])
+        self.species.update(saved["species"])
+        self.played = {tuple(pair) for pair in saved["played"]}
+        self.round = saved["round"]
+
+    def save(self):
+        if not self.checkpoint:
+            return
+        temp = self.checkpoint + ".tmp"
+        with open(temp, 'w') as f:
+            json.dump({
+                "config": self.config,
+                "round": self.round,
+                "ratings": self.ratings,
+                "species": self.species,
+                "played": sorted(self.played),
+            }, f)
+        os.replace(temp, self.checkpoint)
+
+    def _record(self, a, b, score):
+        expected = 1 / (1 + 10 ** ((self.ratings[b] - self.ratings[a]) / 400))
+        self.ratings[a] += K_FACTOR * (score - expected)
+        self.ratings[b] -= K_FACTOR * (score - expected)
+        # species share their team's result, against the other team's average species rating
+        a_names = [self.roster[i].name for i in self.entrants[a][0]]
+        b_names = [self.roster[i].name for i in self.entrants[b][0]]
+        a_rating = sum(self.species[n] for n in a_names) / len(a_names)
+        b_rating = sum(self.species[n] for n in b_names) / len(b_names)
+        expected = 1 / (1 + 10 ** ((b_rating - a_rating) / 400))
+        for name in a_names:
+            self.species[name] += K_FACTOR * (score - expected) / len(a_names)
+        for name in b_names:
+            self.species[name] -= K_FACTOR * (score - expected) / len(b_names)
+        self.played.add((a, b))
+
+    def round_robin_pairs(self):
+        ''' yields the pairs that haven't met yet, so a round only ever holds its own '''
+        for pair in itertools.combinations(sorted(self.entrants), 2):
+            if pair not in self.played:
+                yield pair
+
+    def swiss_pairs(self) -> list[tuple[str, str]]:
+        ''' neighbours by rating, skipping pairs that already met where possible '''
+        waiting = sorted(self.entrants, key=lambda key: (-self.ratings[key], key))
+        pairs = []
+        while len(waiting) > 1:
+            a = waiting.pop(0)
+            partner = next((b for b in waiting if tuple(sorted((a, b))) not in self.played), waiting[0])
+            waiting.remove(partner)
+            pairs.append(tuple(sorted((a, partner))))
+        return pairs
+
+    def _match_key(self, a, b) -> str:
+        (a_team, a_difficulty), (b_team, b_difficulty) = self.entrants[a], self.entrants[b]
+        return result_key(
+            "match", [self.hashes[i] for i in a_team], a_difficulty,
+            [self.hashes[i] for i in b_team], b_difficulty, self.seed, self.games,
+        )
+
+    def _members(self, a, b) -> list[tuple[str, str]]:
+        return [(self.roster[i].name, self.hashes[i]) for key in (a, b) for i in self.entrants[key][0]]
+
+    def _play(self, pairs, pool):
+        scores = {}
+        keys = {}
+        if self.cache is not None:
+            keys = {pair: self._match_key(*pair) for pair in pairs}
+            cached = self.cache.get_many(keys.values())
+            scores = {pair: cached[key] for pair, key in keys.items() if key in cached}
+            self.cache_hits += len(scores)
+        jobs = [
+            ((a, *self.entrants[a]), (b, *self.entrants[b]), self.games, self.seed)
+            for a, b in pairs if (a, b) not in scores
+        ]
+        results = pool.map(_play_match, jobs, chunksize=max(1, len(jobs) // 64)) if pool else map(_play_match, jobs)
+        played = [(a, b, score) for a, b, score in results]
+        if self.cache is not None:
+            self.cache.put_many((keys[(a, b)], score, self._members(a, b)) for a, b, score in played)
+        scores.update(((a, b), score) for a, b, score in played)
+        # ratings move in the order the pairs came in, cached or not
+        for a, b in pairs:
+            self._record(a, b, scores[(a, b)])
+
+    def run(self, format="swiss", rounds=10, workers=None, round_size=1000):
+        '''
+        Plays the tournament, in Swiss rounds or round robin (checkpointed every
+        round_size matches), and returns the ratings.
+        '''
+        workers = workers or os.cpu_count() or 1
+        shared = self.roster if self.snapshot is None else self.snapshot
+        pool = ProcessPoolExecutor(workers, initializer=simulate._init_worker, initargs=(shared,)) if workers > 1 else None
+        if pool is None:
+            simulate._init_worker(shared)
+        try:
+            if format == "swiss":
+                while self.round < rounds:
+                    self._play(self.swiss_pairs(), pool)
+                    self.round += 1
+                    self.save()
+            else:
+                pairs = self.round_robin_pairs()
+                while batch := list(itertools.islice(pairs, round_size)):
+                    self._play(batch, pool)
+                    self.round += 1
+                    self.save()
+        finally:
+            if pool:
+                pool.shutdown()
+        return self.ratings
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate every team and species in a computer-vs-computer tournament.")
+    parser.add_argument('--file', default="pokemon.json")
+    parser.add_argument('--pick-limit', type=int, default=2)
+    parser.add_argument('--difficulties', type=int, nargs='+', default=[2], choices=range(1, MAX_DIFFICULTY + 1))
+    parser.add_argument('--format', choices=["swiss", "round-robin"], default="swiss")
+    parser.add_argument('--rounds', type=int, default=10, help="rounds of a Swiss tournament")
+    parser.add_argument('--games', type=int, default=10, help="battles per match")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--checkpoint', help="file to save progress to and resume from")
+    parser.add_argument('--no-prune', action='store_true', help="keep teams with dominated pokemon")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--no-cache', action='store_true', help="play every match instead of reusing results saved next to the roster")
+    parser.add_argument('--cache-size', type=int, default=200_000, help="most match results to keep")
+    args = parser.parse_args()
+
+    manager = PokemonManager(args.file)
+    roster = manager.snapshot() or manager.pokemon
+    cache = None if args.no_cache else ResultCache(results_path(args.file), args.cache_size)
+    tournament = Tournament(roster, args.pick_limit, args.difficulties, args.games, args.seed, not args.no_prune, args.checkpoint, cache)
+    print(f"{len(tournament.entrants)} entrants")
+    ratings = tournament.run(args.format, args.rounds, args.workers)
+    if cache is not None:
+        print(f"{tournament.cache_hits} matches reused from {cache.path}")
+        cache.close()
+    print("Teams:")
+    for key, rating in sorted(ratings.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {rating:7.1f}  {key}")
+    print("Species:")
+    for name, rating in sorted(tournament.species.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {rating:7.1f}  {name}")
+
+if __name__ == "__main__":
+    main()